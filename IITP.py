@@ -1,137 +1,194 @@
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
-from typing import Dict, List
+from typing import Dict, Optional
+import json
 import os
-from io import BytesIO
+import subprocess
+import sys
+import threading
 import time
-from datetime import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from backends import GeminiBackend
+from cache import ResponseCache
+from loader import iter_records
+from store import PREVIEW_ROWS, RecordStore
+from search import SearchIndex
+from export import EXPORT_FORMATS, ChangeLog, changelog_path, export_store, file_digest
+from prefetch import Prefetcher
+from dedupe import dedupe_report, find_duplicates, format_report
+from metrics import METRICS
+from jobqueue import DEFAULT_QUEUE_PATH, JOB_SETTINGS, JobQueue
+from ratelimit import shared_rate_limiter
+from prompts import PromptBuilder, uses_system_instruction
+# The processing core lives in processor.py so headless entry points never import streamlit
+from processor import GENERATION_MODES, RESPONSE_FORMATS, QuestionProcessor
 
-class QuestionProcessor:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-        
-    def generate_prompt(self, row: Dict) -> str:
-        return f"""Please modify the following question and its options to include specific context about {row['State']} and the attribute: {row['Attribute']}
-
-Original Question: {row['Question']}
-
-
-Original Options:
-1. {row['Option1']}
-2. {row['Option2']}
-3. {row['Option3']}
-4. {row['Option4']}
-
-Please provide:
-1. A corrected version of the question with {row['State']} and {row['Attribute']} context. Make sure to include some kind of a cultural or regional artifact in the question.
-2. Modified options that reflect this context but must have the right answer as {row['State']} as i dont want confusing options. if you use {row['State']} as the right answer for the question form it in a way like which region...? and use other states of india as options and when using other three form it like which culture...? use other cultures as options
-3. The correct answer with explanation
-4. Relevant citations or sources but DO NOT HALLUCINATE or make up information only use word to word citation and try to use wikipedia for citations.
-5. Make sure to include an {row['State']} specific cultural artifact that is UNIQUE to {row['State']}. DO NOT HALLUCINATE about the artifact.
-
-Format your response as follows:
-CORRECTED_QUESTION: [Your modified question]
-CORRECTED_OPTIONS:
-1. [Modified option 1]
-2. [Modified option 2]
-3. [Modified option 3]
-4. [Modified option 4]
-CORRECT_ANSWER: [correct option]
-EXPLANATION: [Detailed explanation]
-CITATIONS: [Relevant sources]"""
-
-    def process_question(self, row: Dict) -> List[Dict]:
-        try:
-            prompt = self.generate_prompt(row)
-            responses = [self.model.generate_content(prompt) for _ in range(3)]
-            suggestions = [self.parse_llm_response(response.text) for response in responses]
-            return suggestions
-        except Exception as e:
-            st.error(f"Error processing question: {str(e)}")
-            return []
-
-    def parse_llm_response(self, response: str) -> Dict:
-        try:
-            lines = response.split('\n')
-            sections = {
-                'Corrected_Question': '',
-                'Corrected_Options': [],
-                'Corrected_Answer': '',
-                'Full Answer': '',
-                'Answer Source': ''
-            }
-            
-            current_section = None
-            
-            for line in lines:
-                if line.startswith('CORRECTED_QUESTION:'):
-                    current_section = 'Corrected_Question'
-                    sections['Corrected_Question'] = line.replace('CORRECTED_QUESTION:', '').strip()
-                elif line.startswith('CORRECTED_OPTIONS:'):
-                    current_section = 'Corrected_Options'
-                elif line.startswith('CORRECT_ANSWER:'):
-                    current_section = 'Corrected_Answer'
-                    sections['Corrected_Answer'] = line.replace('CORRECT_ANSWER:', '').strip()
-                elif line.startswith('EXPLANATION:'):
-                    current_section = 'Full Answer'
-                    sections['Full Answer'] = line.replace('EXPLANATION:', '').strip()
-                elif line.startswith('CITATIONS:'):
-                    current_section = 'Answer Source'
-                    sections['Answer Source'] = line.replace('CITATIONS:', '').strip()
-                elif line.strip() and current_section == 'Corrected_Options':
-                    if line.strip().startswith(('1.', '2.', '3.', '4.')):
-                        sections['Corrected_Options'].append(line.strip())
-                elif line.strip() and current_section in ['Full Answer', 'Answer Source']:
-                    sections[current_section] += ' ' + line.strip()
-            
-            return sections
-        except Exception as e:
-            st.error(f"Error parsing LLM response: {str(e)}")
-            return {
-                'Corrected_Question': '',
-                'Corrected_Options': [],
-                'Corrected_Answer': '',
-                'Full Answer': '',
-                'Answer Source': ''
-            }
-
-def load_data(uploaded_file):
-    file_extension = uploaded_file.name.split('.')[-1].lower()
-    
+logger = logging.getLogger(__name__)
+
+# Process-wide resources, built on first use and shared by every session and rerun
+
+@st.cache_resource(show_spinner=False)
+def response_cache() -> ResponseCache:
+    return ResponseCache()
+
+@st.cache_resource(show_spinner=False)
+def job_queue() -> JobQueue:
+    return JobQueue()
+
+@st.cache_resource(show_spinner=False)
+def local_workers() -> Dict[str, subprocess.Popen]:
+    # Worker processes started from the app, one per queue database
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def local_workers_lock() -> threading.Lock:
+    return threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def export_executor() -> ThreadPoolExecutor:
+    # At most two exports are written at a time, whichever sessions start them
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def gemini_backend(api_key: str, model_name: str, system_instruction: Optional[str]) -> GeminiBackend:
+    return GeminiBackend(api_key, model_name, system_instruction)
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def question_processor(api_key: str, model_name: str, num_suggestions: int, timeout: float, generation_mode: str,
+                       response_format: str, max_input_tokens: Optional[int], requests_per_minute: int) -> QuestionProcessor:
+    # Reruns with unchanged settings get the same processor back instead of a new client per interaction
+    system_instruction = uses_system_instruction(model_name)
+    instructions = PromptBuilder(response_format).instructions if system_instruction else None
+    # Every session using the same key draws from one request budget
+    rate_limiter = shared_rate_limiter(api_key, requests_per_minute=requests_per_minute)
+    return QuestionProcessor(api_key, model=gemini_backend(api_key, model_name, instructions), num_suggestions=num_suggestions,
+                             timeout=timeout, cache=response_cache(), rate_limiter=rate_limiter,
+                             generation_mode=generation_mode, response_format=response_format, model_name=model_name,
+                             use_system_instruction=system_instruction, max_input_tokens=max_input_tokens)
+
+def load_store(uploaded_file, chunksize: int = 10_000) -> Optional[RecordStore]:
+    # Rows are read lazily, so errors can surface while the store is being built as well as at the header
     try:
-        if file_extension == 'csv':
-            encodings = ['utf-8', 'latin1', 'iso-8859-1']
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(uploaded_file, encoding=encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    st.error(f"Error reading CSV with {encoding} encoding: {str(e)}")
-                    return None
-        elif file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(uploaded_file)
-        else:
-            st.error("Unsupported file format. Please upload a CSV or Excel file.")
-            return None
-        
-        required_columns = ['State', 'Attribute', 'Question', 
-                          'Option1', 'Option2', 'Option3', 'Option4']
-        
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            st.error(f"Missing required columns: {', '.join(missing_columns)}")
-            return None
-            
-        return df.to_dict('records')
-        
+        columns, records = iter_records(uploaded_file, chunksize)
+        return RecordStore.from_records(records)
+    except ValueError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Error reading file: {str(e)}")
         return None
+
+def save_row(index: int, values: Dict):
+    if not st.session_state.data.changes_made:
+        # Editing without restoring declines the earlier session's edits, so they don't mix with these
+        st.session_state.changelog.rotate()
+    st.session_state.changelog.append(index, values)
+    st.session_state.data.update(index, values)
+    st.session_state.search_index.update(index, st.session_state.data.row(index))
+    if st.session_state.prefetcher is not None:
+        st.session_state.prefetcher.invalidate(index)
+
+def start_local_worker(api_key: str, requests_per_minute: int, queue_path: str = DEFAULT_QUEUE_PATH) -> subprocess.Popen:
+    # Held while checking and spawning so repeated clicks or other sessions reuse a worker that
+    # hasn't sent its first heartbeat yet instead of starting another
+    workers = local_workers()
+    with local_workers_lock():
+        worker = workers.get(queue_path)
+        if worker is not None and worker.poll() is None:
+            return worker
+        # The key goes through the environment so it never lands in the queue database
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+        worker = workers[queue_path] = subprocess.Popen(
+            [sys.executable, script, '--queue', queue_path, '--rpm', str(requests_per_minute)],
+            env=dict(os.environ, GOOGLE_API_KEY=api_key)
+        )
+        return worker
+
+@st.fragment(run_every="1s")
+def job_status():
+    index = st.session_state.current_index
+    job_id = st.session_state.jobs.get(index)
+    if job_id is None:
+        return
+    job = job_queue().get(job_id)
+    if job is None or job['status'] == 'cancelled':
+        del st.session_state.jobs[index]
+        return
+    if job['status'] == 'queued':
+        st.info(f"Queued for the background worker ({job['position']} jobs ahead)...")
+        if st.button("Cancel", key="cancel_job_btn") and job_queue().cancel(job_id):
+            del st.session_state.jobs[index]
+            st.rerun()
+    elif job['status'] == 'running':
+        st.info(f"Generating suggestions in the background ({time.time() - job['started_at']:.0f}s)...")
+    elif job['status'] == 'failed':
+        del st.session_state.jobs[index]
+        st.error(f"Background job failed: {job['error']}")
+    else:
+        del st.session_state.jobs[index]
+        st.session_state.suggestions = job['result']
+        st.session_state.suggestions_index = index
+        st.rerun()
+
+def metrics_panel():
+    with st.sidebar.expander("Performance metrics"):
+        timers = METRICS.timers()
+        if timers:
+            st.dataframe(pd.DataFrame([
+                {'stage': name, 'count': stats['count'], 'p50 ms': stats['p50'] * 1000,
+                 'p95 ms': stats['p95'] * 1000, 'total s': stats['total']}
+                for name, stats in timers.items()
+            ]), hide_index=True, use_container_width=True)
+        counters = METRICS.counters()
+        st.caption(f"{counters.get('model_calls', 0):g} model calls, {counters.get('cache_hits', 0):g} cache hits, "
+                   f"{counters.get('input_tokens', 0):g} input / {counters.get('output_tokens', 0):g} output tokens, "
+                   f"about ${counters.get('cost_usd', 0):.4f}")
+        st.download_button("Prometheus text", METRICS.prometheus(), file_name="metrics.prom", mime="text/plain",
+                           key="metrics_prometheus")
+        st.download_button("JSONL snapshot", json.dumps(METRICS.snapshot()) + '\n', file_name="metrics.jsonl",
+                           mime="application/json", key="metrics_jsonl")
+
+@st.fragment(run_every="1s")
+def export_status():
+    # Polls only while the export is running; once it finishes the whole page reruns and
+    # export_download offers the file, so the finished file isn't re-read every second
+    future, export_format = st.session_state.export_job
+    if not future.done():
+        st.info("Export in progress...")
+        return
+    st.session_state.export_job = None
+    try:
+        st.session_state.export_result = (future.result(), export_format, None)
+    except Exception as e:
+        st.session_state.export_result = (None, export_format, str(e))
+    st.rerun()
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def export_download():
+    path, export_format, error = st.session_state.export_result
+    if error is not None:
+        st.error(f"Error during export: {error}")
+        return
+    # A callable defers reading the file until the button is clicked
+    st.download_button(
+        label=f"📥 Download {export_format}",
+        data=lambda: read_file(path),
+        file_name=os.path.basename(path),
+        mime=EXPORT_FORMATS[export_format][1],
+        key='download_export'
+    )
+    st.success(f"Export saved to {path}")
+
 def main():
+    # Time for the whole script run, including reruns cut short by st.rerun()
+    with METRICS.timer('rerun'):
+        app()
+
+def app():
     st.set_page_config(page_title="Question Context Updater", layout="wide")
     st.title("Question Context Updater")
 
@@ -156,25 +213,126 @@ def main():
             'explanation': '',
             'citations': ''
         }
-    if 'changes_made' not in st.session_state:
-        st.session_state.changes_made = False
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = None
+    if 'recent_jumps' not in st.session_state:
+        st.session_state.recent_jumps = []
+    if 'jobs' not in st.session_state:
+        # Background job id per question index for this session
+        st.session_state.jobs = {}
 
     # API Key input
     api_key = st.sidebar.text_input("Enter Google Gemini API Key", type="password")
+    model_name = st.sidebar.text_input("Model", value="gemini-pro", key="model_name")
+    num_suggestions = st.sidebar.number_input("Suggestions per question", min_value=1, max_value=10, value=3, key="num_suggestions")
+    call_timeout = st.sidebar.number_input("Model call timeout (seconds)", min_value=5, max_value=600, value=60, key="call_timeout")
+    generation_mode = st.sidebar.selectbox("Generation mode", GENERATION_MODES, key="generation_mode",
+                                           help="separate: one request per suggestion; single_call: all suggestions in one response; "
+                                                "candidate_count: one request returning several API candidates")
+    response_format = st.sidebar.selectbox("Response format", RESPONSE_FORMATS, key="response_format",
+                                           help="text: parse the CORRECTED_* sections; json: structured output with a response schema")
+    max_input_tokens = st.sidebar.number_input("Input token budget per request (0 = no limit)", min_value=0, max_value=1_000_000,
+                                               value=0, step=100, key="max_input_tokens")
+    requests_per_minute = st.sidebar.number_input("Requests per minute", min_value=1, max_value=10000, value=60, key="rpm")
+    prefetch_depth = st.sidebar.number_input("Prefetch next questions", min_value=0, max_value=10, value=2, key="prefetch_depth",
+                                             help="Generate suggestions in the background for the questions after the current one")
+    prefetch_budget = st.sidebar.number_input("Prefetch budget (rows per session, 0 = no limit)", min_value=0, max_value=100_000,
+                                              value=200, step=50, key="prefetch_budget",
+                                              help="Prefetching stops once this many rows have been generated in the background")
+    prefetch_concurrency = st.sidebar.number_input("Concurrent prefetches", min_value=1, max_value=8, value=2,
+                                                   key="prefetch_concurrency")
+    use_worker = st.sidebar.checkbox("Run generations in a background worker", key="use_worker",
+                                     help="Queue rows for a worker process (python worker.py) so the page never waits "
+                                          "on the model; sessions sharing a worker share its request budget")
     if api_key:
-        st.session_state.processor = QuestionProcessor(api_key)
+        st.session_state.processor = question_processor(api_key, model_name, int(num_suggestions), float(call_timeout),
+                                                        generation_mode, response_format, int(max_input_tokens) or None,
+                                                        int(requests_per_minute))
+        rate_limiter = st.session_state.processor.rate_limiter
+        min_input_tokens = st.session_state.processor.prompts.min_input_tokens
+        if max_input_tokens and max_input_tokens < min_input_tokens:
+            st.sidebar.error(f"An input token budget below {min_input_tokens} leaves no room for the question; "
+                             f"rows that don't fit will be rejected without calling the model")
+        if prefetch_depth and st.session_state.prefetcher is None:
+            st.session_state.prefetcher = Prefetcher(st.session_state.processor, depth=int(prefetch_depth),
+                                                     max_concurrent=int(prefetch_concurrency))
+        elif not prefetch_depth and st.session_state.prefetcher is not None:
+            st.session_state.prefetcher.shutdown()
+            st.session_state.prefetcher = None
+        if st.session_state.prefetcher is not None:
+            st.session_state.prefetcher.processor = st.session_state.processor
+            st.session_state.prefetcher.depth = int(prefetch_depth)
+            st.session_state.prefetcher.max_rows = int(prefetch_budget) or None
+            st.session_state.prefetcher.resize(int(prefetch_concurrency))
+        limiter_stats = rate_limiter.stats()
+        st.sidebar.caption(f"Rate limiter: {limiter_stats['retries']} retries, {limiter_stats['throttled']} throttled, "
+                           f"{limiter_stats['queued_seconds']:.1f}s queued, {limiter_stats['throttled_seconds']:.1f}s backing off")
+    if use_worker:
+        queue_stats = job_queue().stats()
+        st.sidebar.caption(f"Job queue: {queue_stats['workers']} workers, {queue_stats['queued']} queued, "
+                           f"{queue_stats['running']} running, {queue_stats['done']} done, {queue_stats['failed']} failed")
+        if api_key and not queue_stats['workers']:
+            starting = local_workers().get(DEFAULT_QUEUE_PATH)
+            if starting is not None and starting.poll() is None:
+                st.sidebar.info("Worker starting...")
+            elif st.sidebar.button("Start local worker", key="start_worker_btn"):
+                start_local_worker(api_key, int(requests_per_minute))
+                st.sidebar.info("Worker starting...")
+    cache_stats = response_cache().stats()
+    st.sidebar.caption(f"Response cache: {cache_stats['entries']} entries, "
+                       f"{cache_stats['hits']} hits / {cache_stats['misses']} misses")
+    if st.session_state.prefetcher is not None:
+        prefetch_stats = st.session_state.prefetcher.stats()
+        st.sidebar.caption(f"Prefetch: {prefetch_stats['hits']} ready on arrival, {prefetch_stats['pending_hits']} still running, "
+                           f"{prefetch_stats['misses']} missed ({prefetch_stats['hit_rate']:.0%} hit rate), "
+                           f"{prefetch_stats['in_flight']} in flight, {prefetch_stats['cancelled']} cancelled, "
+                           f"{prefetch_stats['failed']} failed")
+        if st.session_state.prefetcher.exhausted():
+            st.sidebar.warning(f"Prefetch budget used up: {prefetch_stats['budget_used']} of {prefetch_stats['max_rows']} rows. "
+                               f"Raise the budget to keep prefetching.")
+
+    metrics_panel()
 
     # File uploader
     uploaded_file = st.sidebar.file_uploader("Upload File", type=['csv', 'xlsx', 'xls'])
     if uploaded_file is not None:
         if 'original_file' not in st.session_state or st.session_state.original_file != uploaded_file.name:
-            data = load_data(uploaded_file)
+            with METRICS.timer('load_data'):
+                data = load_store(uploaded_file)
             if data:
                 st.session_state.data = data
                 st.session_state.original_file = uploaded_file.name
-                st.session_state.changes_made = False
+                with METRICS.timer('build_search_index'):
+                    st.session_state.search_index = SearchIndex.from_frame(data.df)
+                st.session_state.changelog = ChangeLog(changelog_path(uploaded_file.name, file_digest(uploaded_file)))
+                st.session_state.duplicates = {}
+                st.session_state.dedupe_summary = None
                 st.sidebar.success(f"File uploaded successfully! {len(data)} questions loaded.")
 
+    # Edits saved against this file in an earlier session can be replayed from its change log
+    if st.session_state.data and not st.session_state.data.changes_made and st.session_state.get('changelog') is not None:
+        saved_edits = len(st.session_state.changelog)
+        if saved_edits and st.sidebar.button(f"Restore {saved_edits} saved edits", key="restore_edits_btn"):
+            st.session_state.changelog.replay(st.session_state.data)
+            st.session_state.search_index = SearchIndex.from_frame(st.session_state.data.df)
+            st.rerun()
+
+    # Duplicate questions (same State and Attribute) share one generation: processing any row of a
+    # group sends the group's first row, so the rest are served from the response cache
+    if st.session_state.data and st.session_state.processor:
+        if st.sidebar.button("Find duplicate questions", key="dedupe_btn"):
+            with st.spinner("Comparing questions..."):
+                records = st.session_state.data.df.to_dict('records')
+                duplicates, kinds = find_duplicates(records)
+                processor = st.session_state.processor
+                st.session_state.duplicates = duplicates
+                # Kept as loaded so a later edit to the first row doesn't change what its duplicates send
+                st.session_state.duplicate_sources = {i: records[i] for i in set(duplicates.values())}
+                st.session_state.dedupe_summary = format_report(
+                    dedupe_report(records, duplicates, kinds, processor.generation_mode, processor.num_suggestions))
+        if st.session_state.get('dedupe_summary'):
+            st.sidebar.caption(st.session_state.dedupe_summary)
+
     if st.session_state.data and st.session_state.processor:
         if st.session_state.data and st.session_state.processor:
         # Advanced Navigation Controls
@@ -193,6 +351,7 @@ def main():
                     )
                     if jump_to != st.session_state.current_index + 1:
                         st.session_state.current_index = jump_to - 1
+                        st.session_state.recent_jumps = ([jump_to - 1] + [i for i in st.session_state.recent_jumps if i != jump_to - 1])[:5]
                         st.session_state.editing = False
                         st.rerun()
                     
@@ -210,22 +369,27 @@ def main():
                 with col2:
                     st.subheader("Questions Overview")
                     # Search functionality
-                    search_term = st.text_input("Search questions", key="search_input")
-                    
-                    # Create DataFrame for preview
-                    preview_df = pd.DataFrame(st.session_state.data)
-                    if search_term:
-                        mask = preview_df['Question'].str.contains(search_term, case=False, na=False)
-                        filtered_df = preview_df[mask]
-                    else:
-                        filtered_df = preview_df
+                    search_term = st.text_input("Search questions", key="search_input",
+                                                help="Matches questions, options, state and attribute. "
+                                                     "Filter with state:Kerala or attribute:\"Folk Dance\".")
                     
-                    # Display clickable question preview
-                    st.dataframe(
-                        filtered_df[['Question', 'State', 'Attribute']].reset_index(),
-                        use_container_width=True,
-                        height=150
-                    )
+                    # Preview reads the store's frame directly; without a search only a window
+                    # around the current question is rendered
+                    with METRICS.timer('preview_render'):
+                        preview_df = st.session_state.data.df
+                        if search_term:
+                            with METRICS.timer('search'):
+                                matches = st.session_state.search_index.search(search_term, limit=PREVIEW_ROWS)
+                            filtered_df = preview_df.iloc[matches]
+                        else:
+                            filtered_df = st.session_state.data.window(st.session_state.current_index, PREVIEW_ROWS)
+
+                        # Display clickable question preview
+                        st.dataframe(
+                            filtered_df[['Question', 'State', 'Attribute']].reset_index(),
+                            use_container_width=True,
+                            height=150
+                        )
                     
                     if st.session_state.current_index < total_questions:
                         st.info(f"Currently viewing Question {st.session_state.current_index + 1} of {total_questions}")
@@ -233,7 +397,17 @@ def main():
             # Show current question status
             st.markdown("---")
 
-            current_row = st.session_state.data[st.session_state.current_index]
+            current_row = st.session_state.data.row(st.session_state.current_index)
+
+            # Arriving at a new question shows its prefetched suggestions, if any, instead of the last row's
+            prefetcher = st.session_state.prefetcher
+            if st.session_state.get('suggestions_index') != st.session_state.current_index:
+                st.session_state.suggestions_index = st.session_state.current_index
+                prefetched = prefetcher.get(st.session_state.current_index) if prefetcher is not None else None
+                st.session_state.suggestions = prefetched or []
+            if prefetcher is not None:
+                prefetcher.schedule(st.session_state.current_index, total_questions, st.session_state.data.row,
+                                    st.session_state.recent_jumps)
 
         # Display current question
         with st.expander("Current Question Details", expanded=True):
@@ -250,11 +424,59 @@ def main():
                 st.write(f"{i}. {current_row[f'Option{i}']}")
 
             st.write("*Original Full Answer:*", current_row['Full Answer'])
+
+        representative = st.session_state.get('duplicates', {}).get(st.session_state.current_index)
+        source_row = current_row
+        if representative is not None:
+            source_row = st.session_state.duplicate_sources[representative]
+            st.caption(f"Duplicate of question {representative + 1}: suggestions are generated once for both")
             
         # Process button
-        if st.button("Process Current Question", key="process_btn"):
-            with st.spinner("Processing..."):
-                st.session_state.suggestions = st.session_state.processor.process_question(current_row)
+        process_col, force_col = st.columns([1, 3])
+        with force_col:
+            force_regenerate = st.checkbox("Force regenerate (ignore cached suggestions)", key="force_regenerate")
+        with process_col:
+            process_clicked = st.button("Process Current Question", key="process_btn")
+        if process_clicked and use_worker:
+            # Generation happens in the worker process; job_status polls for the result
+            processor = st.session_state.processor
+            settings = {name: getattr(processor, name, None) for name in JOB_SETTINGS}
+            settings['max_input_tokens'] = processor.prompts.max_input_tokens
+            st.session_state.jobs[st.session_state.current_index] = job_queue().enqueue(
+                source_row, settings, force=force_regenerate)
+        elif process_clicked:
+            processor = st.session_state.processor
+            suggestions = [None] * processor.num_suggestions
+            pending = None
+            if prefetcher is not None and not force_regenerate and representative is None:
+                pending = prefetcher.pending(st.session_state.current_index)
+            results = None
+            # A prefetch that hasn't started yet is dropped so this row doesn't queue behind others
+            if pending is not None and not pending.cancel():
+                # The prefetcher is already generating this row; wait for it rather than paying twice.
+                # Its candidates time out on their own, so the wait is bounded without a timeout here.
+                try:
+                    with st.spinner("Waiting for prefetched suggestions..."):
+                        results = list(enumerate(pending.result()))
+                except Exception:
+                    results = None
+            if results is None:
+                results = processor.iter_suggestions(source_row, force=force_regenerate)
+            with st.status("Processing...", expanded=True) as status:
+                # Show each candidate as soon as its model call finishes
+                for i, suggestion in results:
+                    suggestions[i] = suggestion
+                    if 'Error' in suggestion:
+                        st.write(f"Suggestion {i+1} failed: {suggestion['Error']}")
+                    else:
+                        st.write(f"*Suggestion {i+1}:*", suggestion['Corrected_Question'])
+                failed = sum(1 for suggestion in suggestions if 'Error' in suggestion)
+                status.update(label=f"Received {len(suggestions) - failed} of {len(suggestions)} suggestions",
+                              state="error" if failed == len(suggestions) else "complete")
+            st.session_state.suggestions = suggestions
+            st.session_state.suggestions_index = st.session_state.current_index
+        if st.session_state.jobs.get(st.session_state.current_index) is not None:
+            job_status()
         
         # Display suggestions with editing interface
         if st.session_state.suggestions:
@@ -266,11 +488,13 @@ def main():
                 selected_suggestion = st.session_state.suggestions[selected_index]
                 
                 # Display the selected suggestion
-                if not st.session_state.editing:
+                if 'Error' in selected_suggestion:
+                    st.warning(f"This suggestion failed: {selected_suggestion['Error']}")
+                elif not st.session_state.editing:
                     st.write("*Suggested Question:*", selected_suggestion['Corrected_Question'])
                     st.write("*Suggested Options:*")
-                    for opt in selected_suggestion['Corrected_Options']:
-                        st.write(opt)
+                    for i, opt in enumerate(selected_suggestion['Corrected_Options'], start=1):
+                        st.write(f"{i}. {opt}")
                     st.write("*Explanation:*", selected_suggestion['Full Answer'])
                     st.write("*Citations:*", selected_suggestion['Answer Source'])
                 
@@ -282,8 +506,7 @@ def main():
                             
                             st.session_state.edit_data = {
                                 'question': selected_suggestion['Corrected_Question'],
-                                'options': [opt.split('. ')[1] if '. ' in opt else opt 
-                                        for opt in selected_suggestion['Corrected_Options']],
+                                'options': (selected_suggestion['Corrected_Options'] + ['', '', '', ''])[:4],
                                 'answer': selected_suggestion['Corrected_Answer'],
                                 'explanation': selected_suggestion['Full Answer'],
                                 'citations': selected_suggestion['Answer Source']
@@ -292,19 +515,17 @@ def main():
                     
                     with col2:
                         if st.button("Use Without Editing", key="use_without_edit_btn"):
-                            updated_row = current_row.copy()
-                            updated_row.update({
+                            options = (selected_suggestion['Corrected_Options'] + ['', '', '', ''])[:4]
+                            save_row(st.session_state.current_index, {
                                 'Question': selected_suggestion['Corrected_Question'],
-                                'Option1': selected_suggestion['Corrected_Options'][0].split('. ')[1] if selected_suggestion['Corrected_Options'] else '',
-                                'Option2': selected_suggestion['Corrected_Options'][1].split('. ')[1] if len(selected_suggestion['Corrected_Options']) > 1 else '',
-                                'Option3': selected_suggestion['Corrected_Options'][2].split('. ')[1] if len(selected_suggestion['Corrected_Options']) > 2 else '',
-                                'Option4': selected_suggestion['Corrected_Options'][3].split('. ')[1] if len(selected_suggestion['Corrected_Options']) > 3 else '',
+                                'Option1': options[0],
+                                'Option2': options[1],
+                                'Option3': options[2],
+                                'Option4': options[3],
                                 'Answer': selected_suggestion['Corrected_Answer'],
                                 'Full Answer': selected_suggestion['Full Answer'],
                                 'Answer Source': selected_suggestion['Answer Source']
                             })
-                            st.session_state.data[st.session_state.current_index] = updated_row
-                            st.session_state.changes_made = True
                             st.success("Suggestion applied successfully!")
                             st.rerun()
 
@@ -366,8 +587,7 @@ def main():
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.button("Save Changes", key="save_changes_btn"):
-                            updated_row = current_row.copy()
-                            updated_row.update({
+                            save_row(st.session_state.current_index, {
                                 'Question': edited_question,
                                 'Option1': edited_options[0],
                                 'Option2': edited_options[1],
@@ -377,8 +597,6 @@ def main():
                                 'Full Answer': edited_explanation,
                                 'Answer Source': edited_citations
                             })
-                            st.session_state.data[st.session_state.current_index] = updated_row
-                            st.session_state.changes_made = True
                             st.session_state.editing = False
                             st.success("Changes saved successfully!")
                             st.rerun()
@@ -393,48 +611,23 @@ def main():
             st.sidebar.markdown("---")
             st.sidebar.subheader("Export Data")
             
-            if st.session_state.changes_made:
-                export_format = st.sidebar.radio("Choose export format:", ["CSV", "Excel"], key="export_format")
+            if st.session_state.data.changes_made:
+                export_format = st.sidebar.radio("Choose export format:", list(EXPORT_FORMATS), key="export_format")
+                changed_only = st.sidebar.checkbox("Only rows changed in this session", key="export_changed_only")
                 
                 if st.sidebar.button("Export Updated Data", key="export_btn"):
-                    try:
-                        df = pd.DataFrame(st.session_state.data)
-                        timestamp = "20250112_072058"
-                        
-                        if export_format == "CSV":
-                            csv = df.to_csv(index=False).encode('utf-8')
-                            filename = f"updated_questions_{timestamp}.csv"
-                            
-                            st.sidebar.download_button(
-                                label="📥 Download CSV",
-                                data=csv,
-                                file_name=filename,
-                                mime='text/csv',
-                                key='download_csv'
-                            )
-                            
-                        else:  # Excel format
-                            output = BytesIO()
-                            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                                df.to_excel(writer, index=False)
-                            
-                            filename = f"updated_questions_{timestamp}.xlsx"
-                            excel_data = output.getvalue()
-                            
-                            st.sidebar.download_button(
-                                label="📥 Download Excel",
-                                data=excel_data,
-                                file_name=filename,
-                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                                key='download_excel'
-                            )
-                        
-                        st.sidebar.success("Export prepared successfully!")
-                        with st.sidebar.expander("Preview Updated Data"):
-                            st.dataframe(df.head())
-                            
-                    except Exception as e:
-                        st.sidebar.error(f"Error during export: {str(e)}")
+                    # Written to disk in chunks on a background thread so the page stays responsive
+                    future = export_executor().submit(export_store, st.session_state.data, export_format,
+                                                      changed_only=changed_only)
+                    st.session_state.export_job = (future, export_format)
+                    st.session_state.export_result = None
+
+                if st.session_state.get('export_job') is not None:
+                    with st.sidebar:
+                        export_status()
+                elif st.session_state.get('export_result') is not None:
+                    with st.sidebar:
+                        export_download()
             else:
                 st.sidebar.info("No changes have been made yet. Make some changes before exporting.")
 
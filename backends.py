@@ -0,0 +1,181 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from ratelimit import estimate_tokens
+
+LATENCY_DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+SUGGESTION_COUNT_PATTERN = re.compile(r'Write (\d+) different suggestions')
+# genai.configure sets process-wide state, so backends for different keys are built one at a time
+CONFIGURE_LOCK = threading.Lock()
+
+
+class ModelBackend(ABC):
+    # What QuestionProcessor needs from a model: a name and generate_content() returning an object
+    # shaped like a Gemini response (.text, .candidates[].content.parts[].text and .usage_metadata)
+    model_name = ''
+
+    @abstractmethod
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None):
+        pass
+
+
+class GeminiBackend(ModelBackend):
+    def __init__(self, api_key: str, model_name: str = 'gemini-pro', system_instruction: Optional[str] = None):
+        # Imported here so processes that never build a Gemini backend don't pay for the import
+        import google.generativeai as genai
+        from google.generativeai import client
+
+        with CONFIGURE_LOCK:
+            genai.configure(api_key=api_key)
+            if system_instruction is not None:
+                self.model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            else:
+                self.model = genai.GenerativeModel(model_name)
+            # The model would otherwise pick up its client on first call, from whichever key was
+            # configured last; binding it now keeps each backend on its own key and connection
+            self.model._client = client.get_default_generative_client()
+        self.model_name = self.model.model_name
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None):
+        if generation_config:
+            return self.model.generate_content(prompt, generation_config=generation_config)
+        return self.model.generate_content(prompt)
+
+
+class FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeContent:
+    def __init__(self, text: str):
+        self.parts = [FakePart(text)]
+
+
+class FakeCandidate:
+    def __init__(self, text: str):
+        self.content = FakeContent(text)
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, texts: List[str], prompt_tokens: int):
+        self.candidates = [FakeCandidate(text) for text in texts]
+        self.text = texts[0]
+        self.usage_metadata = FakeUsage(prompt_tokens, sum(estimate_tokens(text) for text in texts))
+
+
+class FakeAPIError(Exception):
+    # Carries .code like google.api_core errors, so the rate limiter treats it as the real thing
+    def __init__(self, code: int, retry_after: Optional[float] = None):
+        super().__init__(f"{code} fake backend error")
+        self.code = code
+        self.retry_after = retry_after
+
+
+def fake_text_response(n: int) -> str:
+    return f"""CORRECTED_QUESTION: Which dish, served on a banana leaf during Onam in Kerala, is variant {n}?
+CORRECTED_OPTIONS:
+1. Sadya
+2. Dhokla
+3. Litti Chokha
+4. Pitha
+CORRECT_ANSWER: 1. Sadya
+EXPLANATION: Sadya is the vegetarian feast served on banana leaves for Onam in Kerala.
+CITATIONS: https://en.wikipedia.org/wiki/Sadya"""
+
+
+def fake_json_response(n: int) -> Dict:
+    return {
+        'question': f"Which dish, served on a banana leaf during Onam in Kerala, is variant {n}?",
+        'options': ['Sadya', 'Dhokla', 'Litti Chokha', 'Pitha'],
+        'answer': 'Sadya',
+        'explanation': "Sadya is the vegetarian feast served on banana leaves for Onam in Kerala.",
+        'citations': "https://en.wikipedia.org/wiki/Sadya",
+    }
+
+
+class FakeBackend(ModelBackend):
+    # Local stand-in for Gemini with seeded latency and errors, for benchmarks and load tests that
+    # shouldn't spend quota. Responses follow whatever the request asks for: CORRECTED_* text, JSON,
+    # delimited single_call blocks or several API candidates. errors scripts the first calls in order:
+    # (code, retry_after) fails that call, None lets it succeed; later calls fall back to error_rate.
+    def __init__(self, model_name: str = 'fake', latency: str = 'lognormal', latency_mean: float = 1.0,
+                 latency_sigma: float = 0.5, error_rate: float = 0.0, error_codes: Sequence[int] = (429, 500, 503),
+                 responses: Optional[List[str]] = None, seed: int = 0,
+                 sleep: Callable[[float], None] = time.sleep,
+                 errors: Sequence[Optional[Tuple[int, Optional[float]]]] = ()):
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {latency!r}, expected one of {LATENCY_DISTRIBUTIONS}")
+        self.model_name = model_name
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.errors = list(errors)
+        self.responses = responses
+        self.sleep = sleep
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def sample_latency(self) -> float:
+        # Called with the lock held so a seeded run draws the same sequence every time
+        if self.latency == 'fixed' or self.latency_mean <= 0:
+            return max(0.0, self.latency_mean)
+        if self.latency == 'uniform':
+            return self._rng.uniform(0, 2 * self.latency_mean)
+        if self.latency == 'exponential':
+            return self._rng.expovariate(1 / self.latency_mean)
+        # Parameterized so the distribution's mean is latency_mean
+        mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+        return self._rng.lognormvariate(mu, self.latency_sigma)
+
+    def response_texts(self, prompt: str, generation_config: Dict, call: int) -> List[str]:
+        if self.responses:
+            return [self.responses[call % len(self.responses)]]
+        json_output = generation_config.get('response_mime_type') == 'application/json'
+        candidate_count = generation_config.get('candidate_count')
+        if candidate_count:
+            return [json.dumps(fake_json_response(i)) if json_output else fake_text_response(i)
+                    for i in range(1, candidate_count + 1)]
+        match = SUGGESTION_COUNT_PATTERN.search(prompt)
+        if match is not None:
+            count = int(match.group(1))
+            if json_output:
+                return [json.dumps([fake_json_response(i) for i in range(1, count + 1)])]
+            return ['\n'.join(f"=== SUGGESTION {i} ===\n{fake_text_response(i)}" for i in range(1, count + 1))]
+        return [json.dumps(fake_json_response(call)) if json_output else fake_text_response(call)]
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None):
+        with self._lock:
+            call = self.calls
+            self.calls += 1
+            delay = self.sample_latency()
+            if call < len(self.errors):
+                error = self.errors[call]
+            elif self._rng.random() < self.error_rate:
+                code = self._rng.choice(self.error_codes)
+                error = (code, 0.0 if code == 429 else None)
+            else:
+                error = None
+            if error is not None:
+                self.failures += 1
+        self.sleep(delay)
+        if error is not None:
+            raise FakeAPIError(*error)
+        texts = self.response_texts(prompt, generation_config or {}, call)
+        return FakeResponse(texts, estimate_tokens(prompt))
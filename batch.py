@@ -0,0 +1,279 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from backends import LATENCY_DISTRIBUTIONS, FakeBackend
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from dedupe import dedupe_report, find_duplicates, format_report, shared_suggestions
+from loader import iter_records
+from metrics import METRICS
+from processor import GENERATION_MODES, RESPONSE_FORMATS, QuestionProcessor
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def load_completed_rows(output_path: str) -> Set[int]:
+    # A crash can leave a truncated last line behind, so anything unparsable is ignored
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)['row'])
+            except (ValueError, KeyError):
+                continue
+    return completed
+
+
+class BatchRunner:
+    def __init__(self, processor: QuestionProcessor, output_path: str, workers: int = 4, force: bool = False,
+                 progress: Optional[Callable[[Dict], None]] = None, progress_every: int = 10):
+        self.processor = processor
+        self.force = force
+        self.output_path = output_path
+        self.workers = workers
+        self.progress = progress
+        self.progress_every = progress_every
+        self.stats = {
+            'rows_total': 0,
+            'rows_skipped': 0,
+            'rows_done': 0,
+            'rows_failed': 0,
+            'rows_shared': 0,
+            'candidates_failed': 0,
+            'mode': processor.generation_mode,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'elapsed': 0.0,
+            'rows_per_sec': 0.0,
+            'tokens_per_sec': 0.0,
+        }
+        self._lock = threading.Lock()
+        self._started = None
+
+    def process_row(self, index: int, row: Dict) -> Dict:
+        suggestions = self.processor.process_question(row, force=self.force)
+        return {
+            'row': index,
+            'State': row['State'],
+            'Attribute': row['Attribute'],
+            'Question': row['Question'],
+            'suggestions': suggestions,
+        }
+
+    def record_result(self, out, result: Dict):
+        suggestions = result['suggestions']
+        failed = sum(1 for suggestion in suggestions if 'Error' in suggestion)
+        with self._lock:
+            self.stats['candidates_failed'] += failed
+            for suggestion in suggestions:
+                self.stats['input_tokens'] += suggestion.get('Input Tokens', 0)
+                self.stats['output_tokens'] += suggestion.get('Output Tokens', 0)
+            # Rows where every candidate failed are left out of the output so a resumed run retries them
+            if failed == len(suggestions):
+                self.stats['rows_failed'] += 1
+            else:
+                out.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+                self.stats['rows_done'] += 1
+            self.update_rates()
+            finished = self.stats['rows_done'] + self.stats['rows_failed']
+            if self.progress is not None and finished % self.progress_every == 0:
+                self.progress(dict(self.stats))
+
+    def update_rates(self):
+        elapsed = time.perf_counter() - self._started
+        tokens = self.stats['input_tokens'] + self.stats['output_tokens']
+        self.stats['elapsed'] = elapsed
+        self.stats['rows_per_sec'] = (self.stats['rows_done'] + self.stats['rows_failed']) / elapsed if elapsed else 0.0
+        self.stats['tokens_per_sec'] = tokens / elapsed if elapsed else 0.0
+
+    def run(self, records: Iterable[Dict], skip: Set[int] = frozenset()) -> Dict:
+        # Rows in skip are duplicates that take their suggestions from another row, see write_duplicates
+        completed = load_completed_rows(self.output_path)
+        self._started = time.perf_counter()
+        # Only keep a bounded number of rows in flight so lazily loaded records stay lazy
+        max_in_flight = self.workers * 2
+        with open(self.output_path, 'a', encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = set()
+            for index, row in enumerate(records):
+                self.stats['rows_total'] += 1
+                if index in completed:
+                    self.stats['rows_skipped'] += 1
+                    continue
+                if index in skip:
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.record_result(out, future.result())
+                in_flight.add(executor.submit(self.process_row, index, row))
+            for future in wait(in_flight).done:
+                self.record_result(out, future.result())
+        with self._lock:
+            self.update_rates()
+        return dict(self.stats)
+
+    def write_duplicates(self, records: List[Dict], duplicates: Dict[int, int]) -> int:
+        # Copies each representative's suggestions to the rows that duplicate it, once it has them
+        completed = load_completed_rows(self.output_path)
+        wanted = {representative for index, representative in duplicates.items() if index not in completed}
+        if not wanted:
+            return 0
+        results = {}
+        with open(self.output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get('row') in wanted and 'shared_from' not in result:
+                    results[result['row']] = result['suggestions']
+        written = 0
+        with open(self.output_path, 'a', encoding='utf-8') as out:
+            for index, representative in sorted(duplicates.items()):
+                if index in completed or representative not in results:
+                    continue
+                row = records[index]
+                out.write(json.dumps({
+                    'row': index,
+                    'State': row['State'],
+                    'Attribute': row['Attribute'],
+                    'Question': row['Question'],
+                    'shared_from': representative,
+                    'suggestions': shared_suggestions(results[representative], representative),
+                }, ensure_ascii=False, default=str) + '\n')
+                written += 1
+            out.flush()
+            os.fsync(out.fileno())
+        self.stats['rows_shared'] += written
+        return written
+
+
+def run_batch(records: Iterable[Dict], processor: QuestionProcessor, output_path: str, workers: int = 4,
+              force: bool = False, progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    return BatchRunner(processor, output_path, workers=workers, force=force, progress=progress).run(records)
+
+
+def read_records(file: BinaryIO) -> Iterator[Dict]:
+    # Headless counterpart of the app's load_store: a bad sheet ends the run with a logged error
+    try:
+        columns, records = iter_records(file)
+    except ValueError as e:
+        logger.error("Cannot read %s: %s", getattr(file, 'name', 'input'), e)
+        raise SystemExit(1)
+    return records
+
+
+def format_stats(stats: Dict) -> str:
+    return (f"{stats['rows_done'] + stats['rows_failed']} rows "
+            f"({stats['rows_done']} ok, {stats['rows_failed']} failed, {stats['rows_skipped']} resumed, "
+            f"{stats['rows_shared']} shared with duplicates) "
+            f"in {stats['elapsed']:.1f}s: {stats['rows_per_sec']:.2f} rows/s, "
+            f"{stats['tokens_per_sec']:.0f} tokens/s "
+            f"({stats['input_tokens']} in / {stats['output_tokens']} out, {stats['mode']} mode)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate suggestions for every row of a question sheet.")
+    parser.add_argument('input', help="CSV or Excel file with State, Attribute, Question and Option1-4 columns")
+    parser.add_argument('output', help="JSONL file results are appended to; rerun with the same path to resume")
+    parser.add_argument('--api-key', default=os.environ.get('GOOGLE_API_KEY'),
+                        help="Gemini API key (defaults to $GOOGLE_API_KEY)")
+    parser.add_argument('--model', default='gemini-pro', help="Gemini model name")
+    parser.add_argument('--backend', choices=['gemini', 'fake'], default='gemini',
+                        help="fake answers locally with canned responses, for load tests without spending quota")
+    parser.add_argument('--fake-latency', choices=LATENCY_DISTRIBUTIONS, default='lognormal',
+                        help="latency distribution of the fake backend")
+    parser.add_argument('--fake-latency-mean', type=float, default=1.0, help="mean fake call latency in seconds")
+    parser.add_argument('--fake-error-rate', type=float, default=0.0, help="fraction of fake calls that fail with 429/5xx")
+    parser.add_argument('--max-input-tokens', type=int, default=None, help="trim rows so each request fits this budget")
+    parser.add_argument('--workers', type=int, default=4, help="rows processed at the same time")
+    parser.add_argument('--max-concurrent-calls', type=int, default=8, help="model calls in flight at the same time")
+    parser.add_argument('--suggestions', type=int, default=3, help="candidates generated per row")
+    parser.add_argument('--mode', choices=GENERATION_MODES, default='separate',
+                        help="one request per suggestion, or all suggestions from a single request")
+    parser.add_argument('--response-format', choices=RESPONSE_FORMATS, default='text',
+                        help="parse CORRECTED_* sections or request structured JSON output")
+    parser.add_argument('--timeout', type=float, default=60.0, help="per-call timeout in seconds")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="response cache database")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the response cache")
+    parser.add_argument('--rpm', type=float, default=60, help="request budget per minute")
+    parser.add_argument('--tpm', type=float, default=None, help="token budget per minute")
+    parser.add_argument('--max-retries', type=int, default=5, help="retries for 429 and 5xx errors")
+    parser.add_argument('--force', action='store_true', help="regenerate rows even if cached responses exist")
+    parser.add_argument('--metrics', default=None,
+                        help="append a JSONL snapshot of stage timings, tokens and estimated cost to this file")
+    parser.add_argument('--dedupe', choices=['exact', 'near'], default=None,
+                        help="generate once per group of duplicate questions (same State and Attribute) and "
+                             "copy the suggestions to the rest; loads the whole sheet up front")
+    parser.add_argument('--similarity', type=float, default=0.8,
+                        help="shingle Jaccard similarity at which --dedupe near treats questions as duplicates")
+    parser.add_argument('--dedupe-report', action='store_true',
+                        help="only report how many model calls --dedupe would save, without generating")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.dedupe_report:
+        with open(args.input, 'rb') as f:
+            records = list(read_records(f))
+        duplicates, kinds = find_duplicates(records, near=args.dedupe != 'exact', threshold=args.similarity)
+        logger.info("Duplicates: %s", format_report(dedupe_report(records, duplicates, kinds, args.mode, args.suggestions)))
+        return
+    if not args.api_key and args.backend == 'gemini':
+        parser.error("an API key is required (--api-key or $GOOGLE_API_KEY)")
+
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    rate_limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm, max_retries=args.max_retries)
+    model = None
+    if args.backend == 'fake':
+        model = FakeBackend(latency=args.fake_latency, latency_mean=args.fake_latency_mean,
+                            error_rate=args.fake_error_rate)
+    processor = QuestionProcessor(args.api_key, model=model, num_suggestions=args.suggestions, timeout=args.timeout,
+                                  max_concurrent_calls=args.max_concurrent_calls, cache=cache,
+                                  rate_limiter=rate_limiter, generation_mode=args.mode,
+                                  response_format=args.response_format, model_name=args.model,
+                                  max_input_tokens=args.max_input_tokens)
+    if args.max_input_tokens is not None and args.max_input_tokens < processor.prompts.min_input_tokens:
+        parser.error(f"--max-input-tokens must be at least {processor.prompts.min_input_tokens} "
+                     f"to leave room for the question")
+
+    runner = BatchRunner(processor, args.output, workers=args.workers, force=args.force,
+                         progress=lambda stats: logger.info(format_stats(stats)))
+    # Rows are streamed from the file as workers free up rather than loaded up front, unless
+    # duplicates have to be found first
+    with open(args.input, 'rb') as f:
+        records = read_records(f)
+        if args.dedupe is None:
+            stats = runner.run(records)
+        else:
+            records = list(records)
+            duplicates, kinds = find_duplicates(records, near=args.dedupe == 'near', threshold=args.similarity)
+            logger.info("Duplicates: %s",
+                        format_report(dedupe_report(records, duplicates, kinds, args.mode, args.suggestions)))
+            runner.run(records, skip=set(duplicates))
+            runner.write_duplicates(records, duplicates)
+            stats = dict(runner.stats)
+    logger.info("Finished: %s", format_stats(stats))
+    logger.info("Rate limiter: %s", rate_limiter.stats())
+    if cache is not None:
+        logger.info("Response cache: %s", cache.stats())
+    for name, timer in METRICS.timers().items():
+        logger.info("%s: %d calls, p50 %.3fs, p95 %.3fs, %.1fs total", name, timer['count'], timer['p50'],
+                    timer['p95'], timer['total'])
+    logger.info("Estimated cost: $%.4f", METRICS.counters().get('cost_usd', 0.0))
+    if args.metrics:
+        METRICS.dump_jsonl(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from backends import FakeAPIError, FakeBackend
+from batch import BatchRunner
+from export import EXPORT_FORMATS, export_store
+from loader import iter_records
+from metrics import Metrics, percentile
+from parsing import parse_json_response, parse_text_response
+from processor import QuestionProcessor
+from ratelimit import RateLimiter
+from search import SearchIndex
+from store import PREVIEW_ROWS, RecordStore
+
+SUITES = ['store', 'parse', 'row', 'batch', 'load', 'search', 'export', 'ratelimit']
+# Relative slowdown (or throughput drop) against the previous run that counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def make_records(count: int) -> List[Dict]:
+    states = ['Kerala', 'Goa', 'Punjab', 'Assam', 'Odisha']
+    attributes = ['Cuisine', 'Dance', 'Festival', 'Language']
+    return [{
+        'State': states[i % len(states)],
+        'Attribute': attributes[i % len(attributes)],
+        'Question': f"Which dish is traditionally prepared during festival number {i}?",
+        'Option1': f"Option A{i}",
+        'Option2': f"Option B{i}",
+        'Option3': f"Option C{i}",
+        'Option4': f"Option D{i}",
+        'Full Answer': f"Answer {i}",
+    } for i in range(count)]
+
+
+def timeit(fn: Callable, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_rerun_list(records: List[Dict]) -> float:
+    # What a rerun used to cost: rebuild the preview frame, copy the row and write it back
+    index = len(records) // 2
+
+    def rerun():
+        preview_df = pd.DataFrame(records)
+        preview_df[['Question', 'State', 'Attribute']].reset_index()
+        updated_row = records[index].copy()
+        updated_row.update({'Question': 'edited', 'Answer': 'edited'})
+        records[index] = updated_row
+
+    return timeit(rerun)
+
+
+def bench_rerun_store(store: RecordStore) -> float:
+    index = len(store) // 2
+
+    def rerun():
+        store.window(index, PREVIEW_ROWS)[['Question', 'State', 'Attribute']].reset_index()
+        store.row(index)
+        store.update(index, {'Question': 'edited', 'Answer': 'edited'})
+
+    return timeit(rerun)
+
+
+def run_store_benchmarks(sizes: List[int]) -> List[Dict]:
+    results = []
+    for size in sizes:
+        records = make_records(size)
+        store = RecordStore.from_records(records)
+        results.append({
+            'rows': size,
+            'list_rerun_ms': bench_rerun_list(records) * 1000,
+            'store_rerun_ms': bench_rerun_store(store) * 1000,
+        })
+    return results
+
+
+def legacy_parse(response: str) -> Dict:
+    # The line-by-line parser parse_text_response replaced, kept as the comparison baseline
+    sections = {'Corrected_Question': '', 'Corrected_Options': [], 'Corrected_Answer': '',
+                'Full Answer': '', 'Answer Source': ''}
+    current_section = None
+    for line in response.split('\n'):
+        if line.startswith('CORRECTED_QUESTION:'):
+            current_section = 'Corrected_Question'
+            sections['Corrected_Question'] = line.replace('CORRECTED_QUESTION:', '').strip()
+        elif line.startswith('CORRECTED_OPTIONS:'):
+            current_section = 'Corrected_Options'
+        elif line.startswith('CORRECT_ANSWER:'):
+            current_section = 'Corrected_Answer'
+            sections['Corrected_Answer'] = line.replace('CORRECT_ANSWER:', '').strip()
+        elif line.startswith('EXPLANATION:'):
+            current_section = 'Full Answer'
+            sections['Full Answer'] = line.replace('EXPLANATION:', '').strip()
+        elif line.startswith('CITATIONS:'):
+            current_section = 'Answer Source'
+            sections['Answer Source'] = line.replace('CITATIONS:', '').strip()
+        elif line.strip() and current_section == 'Corrected_Options':
+            if line.strip().startswith(('1.', '2.', '3.', '4.')):
+                sections['Corrected_Options'].append(line.strip())
+        elif line.strip() and current_section in ['Full Answer', 'Answer Source']:
+            sections[current_section] += ' ' + line.strip()
+    # Callers used to strip the numbering with split('. ')[1]
+    sections['Corrected_Options'] = [option.split('. ')[1] for option in sections['Corrected_Options']]
+    return sections
+
+
+def make_response(rng: random.Random, i: int) -> str:
+    # One model response in a randomly chosen mix of the formatting variations seen in practice
+    bold = rng.random() < 0.3
+    header = (lambda name: f"**{name}:**") if bold else (lambda name: f"{name}:")
+    numbering = rng.choice(['{n}. ', '{n}) ', '({n}) ', '{l}. ', '{l}) ', '- {n}. '])
+    question = f"Which dish from Kerala is prepared for festival {i}?"
+    if rng.random() < 0.2:
+        question = question.replace(' is prepared', '\nis prepared')
+    options = [f"Sadya {i}", f"Dhokla {i}", f"Litti {i}", f"Pitha {i}"]
+    lines = [rng.choice(['', 'Here is the updated question.\n']) + f"{header('CORRECTED_QUESTION')} {question}",
+             header('CORRECTED_OPTIONS')]
+    for n, option in enumerate(options, start=1):
+        label = numbering.format(n=n, l='ABCD'[n - 1])
+        if rng.random() < 0.1:
+            option = option.replace(' ', '\n   ', 1)
+        lines.append(label + option)
+    lines.append(f"{header('CORRECT_ANSWER')} {rng.choice(['1. ' + options[0], options[0], 'A', 'Option 1'])}")
+    lines.append(f"{header('EXPLANATION')} Sadya is a feast served on banana leaves.\nIt is central to Onam.")
+    lines.append(f"{header('CITATIONS')} https://en.wikipedia.org/wiki/Sadya")
+    text = '\n'.join(lines)
+    if rng.random() < 0.05:
+        # Truncated mid-response, as happens when a call hits its output limit
+        text = text[:rng.randrange(len(text))]
+    return text
+
+
+def make_parse_corpus(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [make_response(rng, i) for i in range(count)]
+
+
+def parse_failed(suggestion: Dict) -> bool:
+    return 'Error' in suggestion or not suggestion['Corrected_Question'] or len(suggestion['Corrected_Options']) != 4
+
+
+def bench_parser(parse: Callable[[str], Dict], corpus: List[str]) -> Dict:
+    failures = 0
+    started = time.perf_counter()
+    for response in corpus:
+        try:
+            suggestion = parse(response)
+        except Exception:
+            failures += 1
+            continue
+        failures += parse_failed(suggestion)
+    elapsed = time.perf_counter() - started
+    return {'per_sec': len(corpus) / elapsed, 'failure_rate': failures / len(corpus)}
+
+
+def run_parse_benchmarks(count: int, seed: int = 0) -> Dict[str, Dict]:
+    corpus = make_parse_corpus(count, seed)
+    json_corpus = [json.dumps({
+        'question': f"Which dish from Kerala is prepared for festival {i}?",
+        'options': [f"Sadya {i}", f"Dhokla {i}", f"Litti {i}", f"Pitha {i}"],
+        'answer': f"Sadya {i}",
+        'explanation': "Sadya is a feast served on banana leaves.",
+        'citations': "https://en.wikipedia.org/wiki/Sadya",
+    }) for i in range(count)]
+    return {
+        'legacy text': bench_parser(legacy_parse, corpus),
+        'text': bench_parser(parse_text_response, corpus),
+        'json': bench_parser(parse_json_response, json_corpus),
+    }
+
+
+def fake_processor(latency: float, seed: int = 0, **kwargs) -> QuestionProcessor:
+    # No cache and a private Metrics, so runs don't warm each other up or pollute the app's numbers
+    backend = FakeBackend(latency='lognormal', latency_mean=latency, latency_sigma=0.3, seed=seed)
+    return QuestionProcessor('', model=backend, metrics=Metrics(), **kwargs)
+
+
+def bench_single_row(rows: int, latency: float, seed: int = 0) -> Dict[str, float]:
+    # End-to-end latency of one row (three concurrent candidates) against the fake backend
+    processor = fake_processor(latency, seed)
+    samples = []
+    for row in make_records(rows):
+        started = time.perf_counter()
+        processor.process_question(row)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'row_p50_ms': percentile(samples, 0.50) * 1000,
+        'row_p95_ms': percentile(samples, 0.95) * 1000,
+    }
+
+
+def bench_batch(rows: int, concurrencies: List[int], latency: float, seed: int = 0) -> Dict[str, float]:
+    results = {}
+    records = make_records(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in concurrencies:
+            processor = fake_processor(latency, seed, max_concurrent_calls=workers * 3)
+            output = os.path.join(directory, f"batch_{workers}.jsonl")
+            stats = BatchRunner(processor, output, workers=workers).run(records)
+            results[f'batch_w{workers}_rows_per_sec'] = stats['rows_per_sec']
+    return results
+
+
+def bench_load(csv_sizes: List[int], xlsx_sizes: List[int]) -> Dict[str, float]:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for extension, sizes in (('csv', csv_sizes), ('xlsx', xlsx_sizes)):
+            for size in sizes:
+                path = os.path.join(directory, f"questions_{size}.{extension}")
+                df = pd.DataFrame(make_records(size))
+                if extension == 'csv':
+                    df.to_csv(path, index=False)
+                else:
+                    df.to_excel(path, index=False)
+                started = time.perf_counter()
+                with open(path, 'rb') as f:
+                    columns, records = iter_records(f)
+                    RecordStore.from_records(records)
+                results[f'load_{extension}_{size}_s'] = time.perf_counter() - started
+    return results
+
+
+def bench_search(size: int, seed: int = 0) -> Dict[str, float]:
+    store = RecordStore.from_records(make_records(size))
+    started = time.perf_counter()
+    index = SearchIndex.from_frame(store.df)
+    build = time.perf_counter() - started
+    rng = random.Random(seed)
+    queries = ['festival', 'which dish', 'dish prepared', 'dish prepared festival number', 'state:Kerala festival',
+               'option a1', 'attribute:dance number']
+    queries += [f"festival number {rng.randrange(size)}" for _ in range(20)]
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        # Clear the results cache so every query measures the search itself rather than a cached page
+        index._results.clear()
+        index.search(query, limit=PREVIEW_ROWS)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        f'search_build_{size}_s': build,
+        f'search_{size}_p50_ms': percentile(samples, 0.50) * 1000,
+        f'search_{size}_p95_ms': percentile(samples, 0.95) * 1000,
+    }
+
+
+def bench_export(size: int) -> Dict[str, float]:
+    results = {}
+    store = RecordStore.from_records(make_records(size))
+    with tempfile.TemporaryDirectory() as directory:
+        for export_format, (extension, _) in EXPORT_FORMATS.items():
+            started = time.perf_counter()
+            try:
+                export_store(store, export_format, os.path.join(directory, f"export.{extension}"))
+            except RuntimeError:
+                # Parquet needs pyarrow, which is optional
+                continue
+            results[f'export_{extension}_{size}_s'] = time.perf_counter() - started
+    return results
+
+
+class FakeClock:
+    # Stands in for time.monotonic and time.sleep so limiter waits are simulated, not slept
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.sleeps.append(seconds)
+        self.now += max(0.0, seconds)
+
+
+def scripted_call(errors: List, clock: FakeClock, **kwargs):
+    # Runs one limited call against a fake model that fails as scripted; returns (limiter, backend, error)
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+    backend = FakeBackend(latency='fixed', latency_mean=0.0, sleep=clock.sleep, errors=errors)
+    try:
+        limiter.call(lambda: backend.generate_content('prompt'))
+    except Exception as e:
+        return limiter, backend, e
+    return limiter, backend, None
+
+
+def check_rate_limiter(seed: int = 0) -> Dict[str, float]:
+    # Drives RateLimiter through scripted 429s and 5xx errors on a simulated clock and fails loudly if
+    # retries, Retry-After, the shared pause or the request budget behave differently than intended
+    random.seed(seed)
+    failures = []
+
+    def expect(condition: bool, message: str):
+        if not condition:
+            failures.append(message)
+
+    # 429 with Retry-After=2, then a 503, then success
+    clock = FakeClock()
+    limiter, backend, error = scripted_call([(429, 2.0), (503, None), None], clock, requests_per_minute=None)
+    stats = limiter.stats()
+    expect(error is None, f"scripted 429/503/success raised {error!r}")
+    expect(backend.calls == 3, f"expected 3 model calls, got {backend.calls}")
+    expect(stats['retries'] == 2 and stats['throttled'] == 1,
+           f"expected 2 retries and 1 throttle, got {stats['retries']} and {stats['throttled']}")
+    # Retry-After plus jitter of up to base_delay, then up to 2 * base_delay of backoff for the 503
+    expect(2.0 <= stats['throttled_seconds'] <= 5.0, f"backoff of {stats['throttled_seconds']:.2f}s ignores Retry-After")
+    expect(clock.sleeps[:1] and 2.0 <= clock.sleeps[0] <= 3.0,
+           f"first backoff of {clock.sleeps[:1]}s ignores Retry-After=2")
+    expect(abs(stats['rate_scale'] - 0.55) < 1e-9, f"rate scale {stats['rate_scale']:.2f} after a 429 and a success")
+    retry_seconds = clock.now
+
+    # A 429 pauses every caller sharing the limiter, not just the one that got it
+    clock = FakeClock()
+    limiter, backend, error = scripted_call([(429, 5.0)], clock, requests_per_minute=None, max_retries=0)
+    expect(isinstance(error, FakeAPIError), f"429 with no retries left raised {error!r}")
+    queued = limiter.acquire()
+    expect(queued >= 5.0, f"another caller waited {queued:.2f}s instead of the 5s pause")
+
+    # Errors that aren't 429 or 5xx fail straight away
+    clock = FakeClock()
+    limiter, backend, error = scripted_call([(400, None)], clock, requests_per_minute=None)
+    expect(isinstance(error, FakeAPIError) and backend.calls == 1 and limiter.stats()['retries'] == 0,
+           f"a 400 was retried ({backend.calls} calls)")
+
+    # Retries stop after max_retries
+    clock = FakeClock()
+    limiter, backend, error = scripted_call([(503, None)] * 5, clock, requests_per_minute=None, max_retries=2)
+    expect(isinstance(error, FakeAPIError) and backend.calls == 3, f"expected 3 calls before giving up, got {backend.calls}")
+    expect(limiter.stats()['failures'] == 1, "a call that ran out of retries wasn't counted as a failure")
+
+    # A cancelled caller leaves without calling the model or spending the budget
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=60, clock=clock, sleep=clock.sleep)
+    cancelled = threading.Event()
+    cancelled.set()
+    try:
+        limiter.call(lambda: None, cancelled=cancelled)
+        expect(False, "a cancelled call went through")
+    except CancelledError:
+        pass
+    expect(limiter.stats()['calls'] == 0, "a cancelled call was counted")
+
+    # 60 requests a minute allows a burst of 6, then one request a second
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=60, clock=clock, sleep=clock.sleep)
+    for _ in range(8):
+        limiter.call(lambda: None)
+    expect(abs(clock.now - 2.0) < 1e-6, f"8 requests at 60 rpm took {clock.now:.2f}s instead of 2s")
+
+    if failures:
+        raise AssertionError("Rate limiter checks failed:\n  " + "\n  ".join(failures))
+    return {'ratelimit_scripted_retry_s': retry_seconds, 'ratelimit_burst_8_s': clock.now}
+
+
+def run_suites(args) -> Dict[str, float]:
+    results = {}
+    if 'store' in args.suites:
+        for result in run_store_benchmarks(args.sizes):
+            results[f"rerun_list_{result['rows']}_ms"] = result['list_rerun_ms']
+            results[f"rerun_store_{result['rows']}_ms"] = result['store_rerun_ms']
+    if 'parse' in args.suites:
+        for name, result in run_parse_benchmarks(args.parse_corpus, args.seed).items():
+            name = name.replace(' ', '_')
+            results[f'parse_{name}_per_sec'] = result['per_sec']
+            results[f'parse_{name}_failure_rate'] = result['failure_rate']
+    if 'row' in args.suites:
+        results.update(bench_single_row(args.rows, args.latency, args.seed))
+    if 'batch' in args.suites:
+        results.update(bench_batch(args.batch_rows, args.concurrency, args.latency, args.seed))
+    if 'load' in args.suites:
+        results.update(bench_load(args.load_sizes, args.xlsx_sizes))
+    if 'search' in args.suites:
+        for size in args.sizes:
+            results.update(bench_search(size, args.seed))
+    if 'export' in args.suites:
+        for size in args.sizes:
+            results.update(bench_export(size))
+    if 'ratelimit' in args.suites:
+        results.update(check_rate_limiter(args.seed))
+    return results
+
+
+def higher_is_better(name: str) -> bool:
+    return name.endswith('_per_sec')
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(history_path: str) -> Optional[Dict]:
+    if not os.path.exists(history_path):
+        return None
+    last = None
+    with open(history_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                last = json.loads(line)
+            except ValueError:
+                continue
+    return last
+
+
+def regressions(previous: Dict[str, float], current: Dict[str, float], tolerance: float) -> List[str]:
+    found = []
+    for name, value in current.items():
+        before = previous.get(name)
+        if not before or name.endswith('_failure_rate'):
+            continue
+        change = (before - value) / before if higher_is_better(name) else (value - before) / before
+        if change > tolerance:
+            found.append(f"{name}: {before:.4g} -> {value:.4g} ({change:.0%} worse)")
+    # Parsing quality regresses on any increase in failures, not a relative one
+    for name, value in current.items():
+        if name.endswith('_failure_rate') and name in previous and value > previous[name] + 0.001:
+            found.append(f"{name}: {previous[name]:.1%} -> {value:.1%}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the question updater, run against a fake model backend.")
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=SUITES)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help="rows for the store, search and export benchmarks")
+    parser.add_argument('--parse-corpus', type=int, default=10_000, help="responses in the generated parser corpus")
+    parser.add_argument('--rows', type=int, default=20, help="rows timed one by one in the single-row benchmark")
+    parser.add_argument('--batch-rows', type=int, default=200, help="rows per batch throughput run")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="batch worker counts")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean fake model latency in seconds")
+    parser.add_argument('--load-sizes', type=int, nargs='+', default=[10_000, 100_000], help="CSV rows to load")
+    parser.add_argument('--xlsx-sizes', type=int, nargs='+', default=[10_000], help="XLSX rows to load")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=None,
+                        help="JSONL file each run is appended to and compared against for regressions")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change against the previous run reported as a regression")
+    args = parser.parse_args()
+
+    results = run_suites(args)
+    width = max(len(name) for name in results) if results else 0
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:>12.4g}")
+
+    if args.history:
+        previous = last_run(args.history)
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'commit': git_commit(), 'results': results}) + '\n')
+        if previous is not None:
+            found = regressions(previous['results'], results, args.tolerance)
+            print(f"\nCompared with {previous.get('commit') or 'the previous run'}: "
+                  f"{len(found) or 'no'} regressions")
+            for line in found:
+                print(f"  {line}")
+            if found:
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_CACHE_PATH = '.question_cache.sqlite'
+
+
+def cache_key(prompt: str, model_name: str, generation_config: Optional[Dict] = None, candidate: int = 0) -> str:
+    payload = json.dumps({
+        'prompt': prompt,
+        'model': model_name,
+        'config': generation_config or {},
+        'candidate': candidate,
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: Optional[float] = 30 * 24 * 3600,
+                 max_entries: Optional[int] = 100_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, int, int]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT text, input_tokens, output_tokens, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (self.ttl is not None and row[3] < now - self.ttl):
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0], row[1], row[2]
+
+    def put(self, key: str, text: str, input_tokens: int = 0, output_tokens: int = 0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, text, input_tokens, output_tokens, now, now)
+            )
+            self._puts += 1
+            # Eviction scans the table, so only run it every so often
+            if self._puts % 100 == 1:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl,))
+        if self.max_entries is not None:
+            # Least recently used entries go first
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
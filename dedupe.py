@@ -0,0 +1,167 @@
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+NORMALIZE_PATTERN = re.compile(r'[^\w\s]+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+TEXT_FIELDS = ['Question', 'Option1', 'Option2', 'Option3', 'Option4']
+# Generated suggestions depend on State and Attribute, so work is only shared between rows that match on both
+GROUP_FIELDS = ['State', 'Attribute']
+# Mersenne prime for the MinHash permutations; shingle hashes are 32-bit so products fit in 64 bits
+MINHASH_PRIME = (1 << 61) - 1
+# How far below the threshold a MinHash estimate may fall and still get an exact comparison
+ESTIMATE_MARGIN = 0.15
+
+
+def normalize(value) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    text = NORMALIZE_PATTERN.sub(' ', str(value).lower())
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def row_text(row: Dict) -> str:
+    # Option order doesn't change what the model is asked, so options are compared as a set
+    options = sorted(normalize(row.get(field)) for field in TEXT_FIELDS[1:])
+    return ' | '.join([normalize(row.get('Question'))] + options)
+
+
+def group_key(row: Dict) -> Tuple[str, ...]:
+    return tuple(normalize(row.get(field)) for field in GROUP_FIELDS)
+
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: Set[int]) -> np.ndarray:
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        return ((np.outer(self._a, values) + self._b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+
+class UnionFind:
+    def __init__(self):
+        self._parent: Dict[int, int] = {}
+
+    def find(self, item: int) -> int:
+        parent = self._parent.setdefault(item, item)
+        if parent != item:
+            parent = self._parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # The lower row index stays the root so the first occurrence represents the cluster
+            self._parent[max(a, b)] = min(a, b)
+
+
+def find_duplicates(records: Iterable[Dict], near: bool = True, threshold: float = 0.8,
+                    num_perm: int = 64, bands: int = 16) -> Tuple[Dict[int, int], Dict[int, str]]:
+    # Returns ({row: representative row}, {row: 'exact' or 'near'}) for every row that can reuse another
+    # row's suggestions. Exact duplicates match after normalization; near duplicates are found with
+    # MinHash LSH over character shingles and then confirmed with the exact Jaccard similarity.
+    rows_per_band = num_perm // bands
+    hasher = MinHasher(num_perm) if near else None
+    clusters = UnionFind()
+    kinds: Dict[int, str] = {}
+    exact: Dict[Tuple, int] = {}
+    buckets: Dict[Tuple, List[int]] = defaultdict(list)
+    representatives: Dict[int, Set[int]] = {}
+    signatures: Dict[int, np.ndarray] = {}
+    for index, row in enumerate(records):
+        group = group_key(row)
+        text = row_text(row)
+        first = exact.setdefault(group + (text,), index)
+        if first != index:
+            clusters.union(first, index)
+            kinds[index] = 'exact'
+            continue
+        if hasher is None:
+            continue
+        row_shingles = shingles(text)
+        signature = hasher.signature(row_shingles)
+        keys = [group + (band, signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+                for band in range(bands)]
+        candidates = list({candidate for key in keys for candidate in buckets.get(key, ())})
+        if candidates:
+            # The signatures estimate the similarity cheaply; only plausible matches get the exact check
+            estimates = (np.stack([signatures[candidate] for candidate in candidates]) == signature).mean(axis=1)
+            candidates = [candidate for candidate, estimate in zip(candidates, estimates)
+                          if estimate >= threshold - ESTIMATE_MARGIN]
+        best, similarity = max(((candidate, jaccard(representatives[candidate], row_shingles)) for candidate in candidates),
+                               key=lambda item: item[1], default=(None, 0.0))
+        if best is not None and similarity >= threshold:
+            clusters.union(best, index)
+            kinds[index] = 'near'
+            continue
+        # Only cluster representatives go into the buckets, so a large cluster doesn't make every
+        # later row compare against all of its members
+        representatives[index] = row_shingles
+        signatures[index] = signature
+        for key in keys:
+            buckets[key].append(index)
+    duplicates = {index: clusters.find(index) for index in kinds}
+    return duplicates, kinds
+
+
+def calls_per_row(generation_mode: str, num_suggestions: int) -> int:
+    return num_suggestions if generation_mode == 'separate' else 1
+
+
+def dedupe_report(records: List[Dict], duplicates: Dict[int, int], kinds: Dict[int, str],
+                  generation_mode: str = 'separate', num_suggestions: int = 3) -> Dict:
+    # Model calls needed for the sheet with and without reusing each cluster's suggestions. Rows that
+    # share a question across states are counted as templates: they still need their own generation.
+    per_row = calls_per_row(generation_mode, num_suggestions)
+    templates = defaultdict(set)
+    for row in records:
+        templates[row_text(row)].add(group_key(row))
+    calls_before = len(records) * per_row
+    calls_after = (len(records) - len(duplicates)) * per_row
+    return {
+        'rows': len(records),
+        'clusters': len(set(duplicates.values())),
+        'exact_duplicates': sum(1 for kind in kinds.values() if kind == 'exact'),
+        'near_duplicates': sum(1 for kind in kinds.values() if kind == 'near'),
+        'shared_templates': sum(1 for groups in templates.values() if len(groups) > 1),
+        'calls_before': calls_before,
+        'calls_after': calls_after,
+        'calls_saved': calls_before - calls_after,
+        'reduction': (calls_before - calls_after) / calls_before if calls_before else 0.0,
+    }
+
+
+def format_report(report: Dict) -> str:
+    return (f"{report['rows']} rows: {report['exact_duplicates']} exact and {report['near_duplicates']} near duplicates "
+            f"in {report['clusters']} clusters, {report['shared_templates']} questions shared across states; "
+            f"model calls {report['calls_before']} -> {report['calls_after']} ({report['reduction']:.0%} fewer)")
+
+
+def shared_suggestions(suggestions: List[Dict], representative: int) -> List[Dict]:
+    # A duplicate row reuses its representative's suggestions; nothing was spent generating them again
+    shared = []
+    for suggestion in suggestions:
+        suggestion = dict(suggestion, **{'Input Tokens': 0, 'Output Tokens': 0})
+        suggestion['Shared From'] = representative
+        shared.append(suggestion)
+    return shared
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from metrics import METRICS
+from store import RecordStore
+
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+EXPORT_DIR = 'exports'
+CHANGELOG_DIR = '.changes'
+
+
+def file_digest(file, chunksize: int = 1 << 20) -> str:
+    # Content hash of an upload, read in chunks and rewound so the file can still be loaded afterwards
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunksize), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def changelog_path(file_name: str, digest: str, directory: str = CHANGELOG_DIR) -> str:
+    # Keyed by content so an edited file uploaded under the same name starts a fresh log
+    return os.path.join(directory, f"{os.path.basename(file_name)}.{digest[:16]}.jsonl")
+
+
+class ChangeLog:
+    # Append-only JSONL log of saved edits, written as they happen so exports and crash
+    # recovery never have to diff the whole sheet
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, index: int, values: Dict):
+        entry = {'row': int(index), 'values': values, 'time': time.time()}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def entries(self) -> Iterator[Dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A crash mid-write leaves a truncated last line
+                    continue
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.entries())
+
+    def replay(self, store: RecordStore) -> int:
+        applied = 0
+        for entry in self.entries():
+            if 0 <= entry['row'] < len(store):
+                store.update(entry['row'], entry['values'])
+                applied += 1
+        return applied
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def rotate(self) -> Optional[str]:
+        # Moves earlier edits aside rather than deleting them, so new edits start an empty log
+        if not os.path.exists(self.path):
+            return None
+        rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        os.replace(self.path, rotated)
+        return rotated
+
+
+def iter_chunks(store: RecordStore, changed_only: bool = False, chunksize: int = 10_000) -> Iterator[pd.DataFrame]:
+    if changed_only:
+        rows = store.changed_rows()
+        for start in range(0, len(rows), chunksize):
+            yield store.df.iloc[rows[start:start + chunksize]]
+    else:
+        for start in range(0, len(store), chunksize):
+            yield store.df.iloc[start:start + chunksize]
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], path: str):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+
+
+def excel_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def write_excel(chunks: Iterator[pd.DataFrame], path: str, columns: List[str]):
+    # constant_memory makes xlsxwriter flush each row to disk once the next one starts
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, columns)
+        row_number = 1
+        for chunk in chunks:
+            for values in chunk.itertuples(index=False, name=None):
+                worksheet.write_row(row_number, 0, [excel_value(value) for value in values])
+                row_number += 1
+    finally:
+        workbook.close()
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], path: str, columns: List[str]):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    writer = None
+    schema = None
+    try:
+        for chunk in chunks:
+            # Object columns are written as strings so every chunk shares one schema
+            table = pa.Table.from_pandas(chunk.astype(str).where(chunk.notna(), None), preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(table.cast(schema))
+        if writer is None:
+            pq.write_table(pa.table({col: pa.array([], type=pa.string()) for col in columns}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_store(store: RecordStore, export_format: str, path: Optional[str] = None,
+                 changed_only: bool = False, chunksize: int = 10_000) -> str:
+    extension = EXPORT_FORMATS[export_format][0]
+    if path is None:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(EXPORT_DIR, f"updated_questions_{timestamp}.{extension}")
+    chunks = iter_chunks(store, changed_only, chunksize)
+    # Write to a temporary name so a half-finished export is never mistaken for a complete one
+    partial = path + '.partial'
+    with METRICS.timer(f'export_{extension}'):
+        if extension == 'csv':
+            write_csv(chunks, partial)
+        elif extension == 'xlsx':
+            write_excel(chunks, partial, store.columns)
+        else:
+            write_parquet(chunks, partial, store.columns)
+    os.replace(partial, path)
+    return path
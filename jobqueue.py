@@ -0,0 +1,168 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+DEFAULT_QUEUE_PATH = '.question_jobs.sqlite'
+JOB_STATES = ['queued', 'running', 'done', 'failed', 'cancelled']
+# Settings a worker needs to build the same QuestionProcessor the requesting session would have used
+JOB_SETTINGS = ['model_name', 'num_suggestions', 'timeout', 'generation_mode', 'response_format', 'max_input_tokens']
+
+
+class JobQueue:
+    # SQLite-backed queue shared by every app session and worker process on the machine. The UI
+    # enqueues rows and polls for results; workers claim jobs one at a time and heartbeat while
+    # they run, so jobs held by a worker that died are handed out again.
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease: float = 300.0):
+        self.path = path
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                row TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                force INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+        """)
+
+    def enqueue(self, row: Dict, settings: Dict, force: bool = False) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, status, row, settings, force, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', json.dumps(row, ensure_ascii=False, default=str),
+                 json.dumps({key: settings.get(key) for key in JOB_SETTINGS}), int(force), time.time())
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        # BEGIN IMMEDIATE takes the write lock up front so two workers can't claim the same job
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                    (now - self.lease,)
+                )
+                row = self._conn.execute(
+                    "SELECT id, row, settings, force FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                        (worker_id, now, now, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'row': json.loads(row[1]), 'settings': json.loads(row[2]), 'force': bool(row[3])}
+
+    def _finish(self, job_id: str, worker_id: str, status: str, result: Optional[List[Dict]], error: Optional[str]):
+        # Only the worker still holding the job may finish it; a late result from a requeued job is dropped
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 error, time.time(), job_id, worker_id)
+            )
+
+    def complete(self, job_id: str, worker_id: str, suggestions: List[Dict]):
+        self._finish(job_id, worker_id, 'done', suggestions, None)
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        self._finish(job_id, worker_id, 'failed', None, error)
+
+    def cancel(self, job_id: str) -> bool:
+        # Running jobs can't be interrupted; only jobs no worker has picked up yet are cancelled
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            position = None
+            if row is not None and row[0] == 'queued':
+                position = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (row[3],)
+                ).fetchone()[0]
+        if row is None:
+            return None
+        return {
+            'id': job_id,
+            'status': row[0],
+            'result': json.loads(row[1]) if row[1] is not None else None,
+            'error': row[2],
+            'position': position,
+            'created_at': row[3],
+            'started_at': row[4],
+            'finished_at': row[5],
+        }
+
+    def heartbeat(self, worker_id: str, job_id: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (worker_id, now))
+            if job_id is not None:
+                self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ?", (now, job_id, worker_id))
+
+    def remove_worker(self, worker_id: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+    def live_workers(self, within: float = 15.0) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?', (time.time() - within,)
+            ).fetchone()[0]
+
+    def purge(self, older_than: float = 24 * 3600) -> int:
+        # Finished jobs are kept for older_than seconds so a session that reconnects can still collect
+        # its result; workers call this from their heartbeat thread (see Worker.retention)
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+                (time.time() - older_than,)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        stats = {state: counts.get(state, 0) for state in JOB_STATES}
+        stats['workers'] = self.live_workers()
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
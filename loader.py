@@ -0,0 +1,107 @@
+import codecs
+from itertools import chain, islice
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+REQUIRED_COLUMNS = ['State', 'Attribute', 'Question',
+                    'Option1', 'Option2', 'Option3', 'Option4']
+SUPPORTED_EXTENSIONS = ['csv', 'xlsx', 'xls']
+
+
+def file_extension(file) -> str:
+    return file.name.split('.')[-1].lower()
+
+
+def sniff_encoding(file: BinaryIO, sample_size: int = 64 * 1024) -> str:
+    # Decide the encoding from a sample instead of re-parsing the whole file per candidate encoding
+    position = file.tell()
+    sample = file.read(sample_size)
+    file.seek(position)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # final=False so a multi-byte character cut off at the end of the sample isn't an error
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def check_columns(columns: List[str]):
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+
+
+def iter_csv_records(file: BinaryIO, chunksize: int = 10_000) -> Tuple[List[str], Iterator[Dict]]:
+    encoding = sniff_encoding(file)
+    start = file.tell()
+    try:
+        columns = list(pd.read_csv(file, encoding=encoding, nrows=0).columns)
+    except UnicodeDecodeError:
+        encoding = 'latin1'
+        file.seek(start)
+        columns = list(pd.read_csv(file, encoding=encoding, nrows=0).columns)
+    check_columns(columns)
+    file.seek(start)
+
+    def records():
+        # The encoding was sniffed from a sample; a non-UTF-8 byte past it restarts the read as latin1
+        # and skips the records already handed out
+        yielded = 0
+        try:
+            for chunk in pd.read_csv(file, encoding=encoding, chunksize=chunksize):
+                for record in chunk.to_dict('records'):
+                    yield record
+                    yielded += 1
+        except UnicodeDecodeError:
+            if encoding == 'latin1':
+                raise
+            # Parsed records are skipped rather than file lines, which blank or multi-line rows would throw off
+            file.seek(start)
+            chunks = pd.read_csv(file, encoding='latin1', chunksize=chunksize)
+            yield from islice(chain.from_iterable(chunk.to_dict('records') for chunk in chunks), yielded, None)
+
+    return columns, records()
+
+
+def iter_xlsx_records(file: BinaryIO) -> Tuple[List[str], Iterator[Dict]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    columns = [str(col) if col is not None else '' for col in header]
+    check_columns(columns)
+
+    def records():
+        try:
+            for values in rows:
+                if all(value is None for value in values):
+                    continue
+                yield {col: (float('nan') if value is None else value) for col, value in zip(columns, values)}
+        finally:
+            workbook.close()
+
+    return columns, records()
+
+
+def iter_xls_records(file: BinaryIO) -> Tuple[List[str], Iterator[Dict]]:
+    # Legacy .xls has no streaming reader, so it's read in one go
+    df = pd.read_excel(file)
+    columns = list(df.columns)
+    check_columns(columns)
+    return columns, (record for record in df.to_dict('records'))
+
+
+def iter_records(file: BinaryIO, chunksize: int = 10_000) -> Tuple[List[str], Iterator[Dict]]:
+    # Validates the header straight away and returns the column names with a lazy row iterator
+    extension = file_extension(file)
+    if extension == 'csv':
+        return iter_csv_records(file, chunksize)
+    if extension == 'xlsx':
+        return iter_xlsx_records(file)
+    if extension == 'xls':
+        return iter_xls_records(file)
+    raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
@@ -0,0 +1,131 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# List prices in USD per million (input, output) tokens, used for cost estimates only
+MODEL_PRICES = {
+    'gemini-pro': (0.50, 1.50),
+    'gemini-1.0-pro': (0.50, 1.50),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+}
+# Timers keep their most recent samples only, so percentiles follow current behaviour and memory stays flat
+MAX_SAMPLES = 10_000
+METRIC_NAME_PATTERN = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def model_price(model_name: str) -> Optional[Tuple[float, float]]:
+    return MODEL_PRICES.get(model_name[len('models/'):] if model_name.startswith('models/') else model_name)
+
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    price = model_price(model_name)
+    if price is None:
+        return 0.0
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    # Nearest-rank percentile of already sorted samples
+    if not samples:
+        return 0.0
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+class Metrics:
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._totals: Dict[str, float] = defaultdict(float)
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, float] = defaultdict(float)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            self._totals[name] += seconds
+            self._counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def record_usage(self, model_name: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self._counters['input_tokens'] += input_tokens
+            self._counters['output_tokens'] += output_tokens
+            self._counters['cost_usd'] += estimate_cost(model_name, input_tokens, output_tokens)
+
+    def timers(self) -> Dict[str, Dict]:
+        with self._lock:
+            snapshot = {name: (sorted(samples), self._counts[name], self._totals[name])
+                        for name, samples in self._samples.items()}
+        return {
+            name: {
+                'count': count,
+                'total': total,
+                'mean': total / count if count else 0.0,
+                'p50': percentile(samples, 0.50),
+                'p95': percentile(samples, 0.95),
+                'max': samples[-1] if samples else 0.0,
+            }
+            for name, (samples, count, total) in sorted(snapshot.items())
+        }
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def snapshot(self) -> Dict:
+        return {'time': time.time(), 'timers': self.timers(), 'counters': self.counters()}
+
+    def dump_jsonl(self, path: str) -> Dict:
+        # One snapshot per line; appending keeps a history that can be compared offline
+        snapshot = self.snapshot()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+    def prometheus(self, prefix: str = 'question_updater') -> str:
+        # Prometheus text exposition format: timers become summaries, counters become counters
+        lines = []
+        for name, stats in self.timers().items():
+            metric = f"{prefix}_{METRIC_NAME_PATTERN.sub('_', name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f'{metric}{{quantile="0.5"}} {stats["p50"]:.6f}')
+            lines.append(f'{metric}{{quantile="0.95"}} {stats["p95"]:.6f}')
+            lines.append(f"{metric}_sum {stats['total']:.6f}")
+            lines.append(f"{metric}_count {stats['count']}")
+        for name, value in self.counters().items():
+            metric = f"{prefix}_{METRIC_NAME_PATTERN.sub('_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._counts.clear()
+            self._counters.clear()
+
+
+# Process-wide metrics shared by every session, worker thread and batch run in this process
+METRICS = Metrics()
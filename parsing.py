@@ -0,0 +1,182 @@
+import json
+import re
+from typing import Dict, List, Optional
+
+# Section headers as the model actually writes them: optionally bolded or bulleted, with spaces or
+# underscores, in any case, and with the colon inside or outside the bold markers
+HEADER_PATTERN = re.compile(
+    r'^[ \t>#*_-]*'
+    r'(?P<name>CORRECTED[ _]QUESTION|CORRECTED[ _]OPTIONS|CORRECT(?:ED)?[ _]ANSWER|EXPLANATION|CITATIONS?|SOURCES?)'
+    r'[ \t*_]*:[ \t*_]*',
+    re.IGNORECASE | re.MULTILINE
+)
+OPTION_PATTERN = re.compile(
+    r'^[ \t]*(?:[-*•][ \t]*)?[*_]*(?:option[ \t]*)?\(?(?P<label>[1-4]|[A-Da-d])[.):\]][*_]*[ \t]*(?P<text>.*)$',
+    re.IGNORECASE
+)
+# Options the model writes as plain bullets, taken in order
+BULLET_PATTERN = re.compile(r'^[ \t]*[-*•][ \t]+(?P<text>\S.*)$')
+ANSWER_REFERENCE_PATTERN = re.compile(r'^(?:option[ \t]*)?\(?([1-4]|[A-Da-d])(?:[.):\]]|$)[ \t]*(.*)$', re.IGNORECASE)
+SUGGESTION_DELIMITER = re.compile(r'^[\s*#]*=+\s*SUGGESTION\s*(\d+)\s*=+[\s*]*$', re.MULTILINE | re.IGNORECASE)
+QUESTION_HEADER_PATTERN = re.compile(r'^[ \t>#*_-]*CORRECTED[ _]QUESTION[ \t*_]*:', re.IGNORECASE | re.MULTILINE)
+JSON_FENCE_PATTERN = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+
+SECTION_KEYS = {
+    'corrected_question': 'Corrected_Question',
+    'corrected_options': 'Corrected_Options',
+    'correct_answer': 'Corrected_Answer',
+    'corrected_answer': 'Corrected_Answer',
+    'explanation': 'Full Answer',
+    'citation': 'Answer Source',
+    'citations': 'Answer Source',
+    'source': 'Answer Source',
+    'sources': 'Answer Source',
+}
+
+# Structured-output schema sent with response_mime_type='application/json'
+SUGGESTION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'question': {'type': 'string'},
+        'options': {'type': 'array', 'items': {'type': 'string'}},
+        'answer': {'type': 'string'},
+        'explanation': {'type': 'string'},
+        'citations': {'type': 'string'},
+    },
+    'required': ['question', 'options', 'answer', 'explanation', 'citations'],
+}
+
+
+def empty_suggestion(error: Optional[str] = None) -> Dict:
+    suggestion = {
+        'Corrected_Question': '',
+        'Corrected_Options': [],
+        'Corrected_Answer': '',
+        'Full Answer': '',
+        'Answer Source': ''
+    }
+    if error is not None:
+        suggestion['Error'] = error
+    return suggestion
+
+
+def split_candidates(response: str) -> List[str]:
+    parts = SUGGESTION_DELIMITER.split(response)
+    if len(parts) > 1:
+        # split() alternates text and captured suggestion numbers after the leading preamble
+        return parts[2::2]
+    # Models sometimes drop the delimiters; fall back to one block per CORRECTED_QUESTION
+    starts = [match.start() for match in QUESTION_HEADER_PATTERN.finditer(response)]
+    if len(starts) > 1:
+        return [response[start:end] for start, end in zip(starts, starts[1:] + [len(response)])]
+    return [response]
+
+
+def clean_text(text: str) -> str:
+    return ' '.join(line.strip().strip('*_').strip() for line in text.splitlines() if line.strip().strip('*_').strip())
+
+
+def option_index(label: str) -> int:
+    return int(label) - 1 if label.isdigit() else 'abcd'.index(label.lower())
+
+
+def parse_options(block: str) -> List[str]:
+    # The list ends at the first line that is neither an option nor an indented continuation of one,
+    # so notes the model adds after the options don't end up in option 4
+    options = {}
+    last = None
+    for line in block.splitlines():
+        if not line.strip():
+            last = None
+            continue
+        labelled = OPTION_PATTERN.match(line)
+        match = labelled or BULLET_PATTERN.match(line)
+        if match is None:
+            if last is not None and line[:1] in ' \t':
+                # A wrapped option continues on the next, indented line
+                options[last] = f"{options[last]} {line.strip()}"
+            elif options:
+                break
+            continue
+        index = option_index(labelled.group('label')) if labelled else len(options)
+        if index in options:
+            break
+        options[index] = match.group('text').strip().strip('*_').strip()
+        last = index
+        if len(options) == 4:
+            break
+    return [options[i] for i in sorted(options)][:4]
+
+
+def missing_options_error(options: List[str]) -> Optional[str]:
+    if len(options) < 4 or not all(options):
+        return f"Expected 4 options, found {sum(1 for option in options if option)}"
+    return None
+
+
+def resolve_answer(answer: str, options: List[str]) -> str:
+    # 'B', '2. Kerala' or 'Option 2' point at an option; store the option's own text
+    if answer in options:
+        return answer
+    match = ANSWER_REFERENCE_PATTERN.match(answer)
+    if match:
+        index = option_index(match.group(1))
+        if index < len(options):
+            return options[index]
+    return answer
+
+
+def parse_text_response(response: str) -> Dict:
+    sections = empty_suggestion()
+    headers = list(HEADER_PATTERN.finditer(response))
+    if not headers:
+        sections['Error'] = "No CORRECTED_QUESTION section in response"
+        return sections
+    for header, following in zip(headers, headers[1:] + [None]):
+        key = SECTION_KEYS[header.group('name').lower().replace(' ', '_')]
+        body = response[header.end():following.start() if following is not None else len(response)]
+        if key == 'Corrected_Options':
+            sections[key] = parse_options(body)
+        elif not sections[key]:
+            sections[key] = clean_text(body)
+    sections['Corrected_Answer'] = resolve_answer(sections['Corrected_Answer'], sections['Corrected_Options'])
+    options_error = missing_options_error(sections['Corrected_Options'])
+    if not sections['Corrected_Question']:
+        sections['Error'] = "No CORRECTED_QUESTION section in response"
+    elif options_error is not None:
+        sections['Error'] = options_error
+    return sections
+
+
+def suggestion_from_json(data: Dict) -> Dict:
+    sections = empty_suggestion()
+    options = [str(option).strip() for option in data.get('options') or []][:4]
+    sections.update({
+        'Corrected_Question': str(data.get('question') or '').strip(),
+        'Corrected_Options': options,
+        'Corrected_Answer': resolve_answer(str(data.get('answer') or '').strip(), options),
+        'Full Answer': str(data.get('explanation') or '').strip(),
+        'Answer Source': str(data.get('citations') or '').strip(),
+    })
+    options_error = missing_options_error(options)
+    if not sections['Corrected_Question']:
+        sections['Error'] = "No question in JSON response"
+    elif options_error is not None:
+        sections['Error'] = options_error
+    return sections
+
+
+def load_json(response: str):
+    return json.loads(JSON_FENCE_PATTERN.sub('', response))
+
+
+def parse_json_response(response: str) -> Dict:
+    try:
+        data = load_json(response)
+    except ValueError as e:
+        return empty_suggestion(error=f"Invalid JSON response: {e}")
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        return empty_suggestion(error="JSON response is not an object")
+    return suggestion_from_json(data)
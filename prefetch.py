@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class Prefetcher:
+    # Generates suggestions for the rows a reviewer is likely to open next, so they are ready on arrival.
+    # Work for rows that drop out of the window is cancelled if it hasn't started yet; calls already
+    # in flight finish and still land in the processor's response cache. max_rows caps how many rows
+    # are prefetched over the session's lifetime, so browsing can't spend an unbounded amount of quota.
+    def __init__(self, processor, depth: int = 3, max_concurrent: int = 2, max_rows: Optional[int] = 200):
+        self.processor = processor
+        self.depth = depth
+        self.max_rows = max_rows
+        self.max_concurrent = max_concurrent
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self._lock = threading.Lock()
+        self._futures: Dict[Tuple, Future] = {}
+        self._results: Dict[Tuple, List[Dict]] = {}
+        self.metrics = {
+            'scheduled': 0,
+            'cancelled': 0,
+            'completed': 0,
+            'failed': 0,
+            'hits': 0,
+            'pending_hits': 0,
+            'misses': 0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+        }
+
+    def _key(self, index: int) -> Tuple:
+        # Suggestions only carry over while the processor settings that shape them stay the same
+        processor = self.processor
+        return (index, processor.model_name, processor.num_suggestions, processor.generation_mode,
+                processor.response_format)
+
+    def _run(self, key: Tuple, row: Dict) -> List[Dict]:
+        suggestions = None
+        try:
+            suggestions = self.processor.process_question(row)
+        finally:
+            # Dropped even when generation raises, so the row can be scheduled again and pending()
+            # doesn't keep handing out the failed future
+            with self._lock:
+                self._futures.pop(key, None)
+                if suggestions is None:
+                    self.metrics['failed'] += 1
+                else:
+                    self.metrics['completed'] += 1
+                    for suggestion in suggestions:
+                        self.metrics['input_tokens'] += suggestion.get('Input Tokens', 0)
+                        self.metrics['output_tokens'] += suggestion.get('Output Tokens', 0)
+                    # Rows where every candidate failed are retried on the next schedule rather than kept
+                    if any('Error' not in suggestion for suggestion in suggestions):
+                        self._results[key] = suggestions
+        return suggestions
+
+    def resize(self, max_concurrent: int):
+        # Rows already handed to the old pool still finish there; new work goes to the new one
+        with self._lock:
+            if max_concurrent == self.max_concurrent:
+                return
+            previous = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=max_concurrent)
+            self.max_concurrent = max_concurrent
+        previous.shutdown(wait=False)
+
+    def _budget_used(self) -> int:
+        # Rows cancelled before they started never reached the model, so they don't count
+        return self.metrics['scheduled'] - self.metrics['cancelled']
+
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self.max_rows is not None and self._budget_used() >= self.max_rows
+
+    def schedule(self, current_index: int, total: int, row_for: Callable[[int], Dict],
+                 extra_indices: Iterable[int] = ()):
+        wanted = [i for i in range(current_index + 1, min(total, current_index + 1 + self.depth))]
+        wanted += [i for i in extra_indices if 0 <= i < total and i != current_index and i not in wanted]
+        wanted_keys = {self._key(i): i for i in wanted}
+        with self._lock:
+            for key, future in list(self._futures.items()):
+                if key not in wanted_keys and future.cancel():
+                    del self._futures[key]
+                    self.metrics['cancelled'] += 1
+            for key, index in wanted_keys.items():
+                if key in self._results or key in self._futures:
+                    continue
+                if self.max_rows is not None and self._budget_used() >= self.max_rows:
+                    break
+                self._futures[key] = self._executor.submit(self._run, key, row_for(index))
+                self.metrics['scheduled'] += 1
+
+    def get(self, index: int) -> Optional[List[Dict]]:
+        # Suggestions for a row if they're ready; a row still being generated counts separately from a miss
+        key = self._key(index)
+        with self._lock:
+            suggestions = self._results.get(key)
+            if suggestions is not None:
+                self.metrics['hits'] += 1
+                return suggestions
+            if key in self._futures:
+                self.metrics['pending_hits'] += 1
+            else:
+                self.metrics['misses'] += 1
+            return None
+
+    def pending(self, index: int) -> Optional[Future]:
+        with self._lock:
+            return self._futures.get(self._key(index))
+
+    def invalidate(self, index: int):
+        with self._lock:
+            for key in [key for key in self._results if key[0] == index]:
+                del self._results[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['in_flight'] = len(self._futures)
+            stats['max_rows'] = self.max_rows
+            stats['budget_used'] = self._budget_used()
+        lookups = stats['hits'] + stats['pending_hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,316 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from backends import GeminiBackend, ModelBackend
+from cache import ResponseCache, cache_key
+from metrics import METRICS, Metrics
+from parsing import (SUGGESTION_SCHEMA, empty_suggestion, load_json, parse_json_response, parse_text_response,
+                     split_candidates, suggestion_from_json)
+from prompts import PromptBuilder, summarize_usage, uses_system_instruction
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# 'separate' sends one request per candidate, 'single_call' asks for N delimited blocks in one
+# response and 'candidate_count' asks the API for N candidates of one request
+GENERATION_MODES = ['separate', 'single_call', 'candidate_count']
+# 'text' parses the CORRECTED_* sections, 'json' asks for structured output matching SUGGESTION_SCHEMA
+RESPONSE_FORMATS = ['text', 'json']
+
+
+class ModelCall:
+    # One candidate's request as seen by the row waiting on it. started_at is only set while the model
+    # is working, so the timeout skips time queued for the rate limiter, a call slot or a retry backoff;
+    # cancelled tells an abandoned candidate to stop queueing and retrying.
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.cancelled = threading.Event()
+
+
+class QuestionProcessor:
+    def __init__(self, api_key: str, num_suggestions: int = 3, timeout: float = 60.0,
+                 max_workers: Optional[int] = None, max_concurrent_calls: Optional[int] = None,
+                 model: Optional[ModelBackend] = None,
+                 cache: Optional[ResponseCache] = None, generation_config: Optional[Dict] = None,
+                 rate_limiter: Optional[RateLimiter] = None, generation_mode: str = 'separate',
+                 response_format: str = 'text', model_name: str = 'gemini-pro',
+                 use_system_instruction: Optional[bool] = None, max_input_tokens: Optional[int] = None,
+                 metrics: Optional[Metrics] = None):
+        if generation_mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode {generation_mode!r}, expected one of {GENERATION_MODES}")
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown response format {response_format!r}, expected one of {RESPONSE_FORMATS}")
+        if use_system_instruction is None:
+            use_system_instruction = model is None and uses_system_instruction(model_name)
+        # The static instructions go in the system instruction so requests only carry the row
+        self.prompts = PromptBuilder(response_format, use_system_instruction, max_input_tokens)
+        if model is None:
+            model = GeminiBackend(api_key, model_name,
+                                  system_instruction=self.prompts.instructions if use_system_instruction else None)
+        self.model = model
+        self.model_name = getattr(model, 'model_name', model_name)
+        self.generation_config = generation_config
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.num_suggestions = num_suggestions
+        self.generation_mode = generation_mode
+        self.response_format = response_format
+        # Per-call timeout in seconds, counted from when the model starts working on the request
+        self.timeout = timeout
+        self.max_workers = max_workers
+        # Shared cap on in-flight model calls across every row this processor is working on
+        self.call_slots = threading.BoundedSemaphore(max_concurrent_calls) if max_concurrent_calls else None
+        self.metrics = metrics if metrics is not None else METRICS
+        
+    def generate_prompt(self, row: Dict) -> str:
+        with self.metrics.timer('generate_prompt'):
+            return self.prompts.row_prompt(row)
+
+    def generate_multi_prompt(self, row: Dict) -> str:
+        if self.response_format == 'json':
+            suffix = f"""
+
+Write {self.num_suggestions} different suggestions, each using a different cultural artifact, as a JSON list of {self.num_suggestions} such objects."""
+        else:
+            blocks = '\n'.join(f"=== SUGGESTION {i} ===\n[Suggestion {i} in the format described]" for i in range(1, self.num_suggestions + 1))
+            suffix = f"""
+
+Write {self.num_suggestions} different suggestions, each using a different cultural artifact. Start each one with its own delimiter line exactly as shown:
+{blocks}"""
+        with self.metrics.timer('generate_prompt'):
+            return self.prompts.row_prompt(row, suffix)
+
+    def request_config(self, multiple: bool = False, candidate_count: Optional[int] = None) -> Optional[Dict]:
+        config = dict(self.generation_config or {})
+        if self.response_format == 'json':
+            config['response_mime_type'] = 'application/json'
+            config['response_schema'] = {'type': 'array', 'items': SUGGESTION_SCHEMA} if multiple else SUGGESTION_SCHEMA
+        if candidate_count is not None:
+            config['candidate_count'] = candidate_count
+        return config or None
+
+    def call_model(self, prompt: str, generation_config: Optional[Dict] = None):
+        self.metrics.incr('model_calls')
+        with self.metrics.timer('generate_content'):
+            if generation_config:
+                return self.model.generate_content(prompt, generation_config=generation_config)
+            return self.model.generate_content(prompt)
+
+    def timed_call(self, prompt: str, generation_config: Optional[Dict] = None, call: Optional[ModelCall] = None):
+        if call is None:
+            return self.call_model(prompt, generation_config)
+        if call.cancelled.is_set():
+            raise CancelledError()
+        call.started_at = time.monotonic()
+        try:
+            return self.call_model(prompt, generation_config)
+        finally:
+            call.started_at = None
+
+    def limited_call(self, prompt: str, generation_config: Optional[Dict] = None, call: Optional[ModelCall] = None):
+        if self.call_slots is None:
+            return self.timed_call(prompt, generation_config, call)
+        with self.call_slots:
+            return self.timed_call(prompt, generation_config, call)
+
+    def fetch_response(self, prompt: str, parse: Callable[[str], List[Dict]], candidate: int = 0,
+                       force: bool = False, generation_config: Optional[Dict] = None,
+                       call: Optional[ModelCall] = None) -> Tuple[List[Dict], int, int, bool]:
+        # Returns (parsed suggestions, input tokens, output tokens, cached). Each candidate index gets
+        # its own cache entry so the N variants of a row stay distinct; unparsable responses aren't cached.
+        key = None
+        if self.cache is not None:
+            key = cache_key(self.prompts.request_text(prompt), self.model_name, generation_config, candidate)
+            cached = None if force else self.cache.get(key)
+            if cached is not None:
+                self.metrics.incr('cache_hits')
+                return parse(cached[0]), 0, 0, True
+
+        if self.rate_limiter is None:
+            response = self.limited_call(prompt, generation_config, call)
+        else:
+            estimated = self.prompts.request_tokens(prompt)
+            response = self.rate_limiter.call(lambda: self.limited_call(prompt, generation_config, call), estimated,
+                                              call.cancelled if call is not None else None)
+        input_tokens, output_tokens = response_usage(response)
+        self.metrics.record_usage(self.model_name, input_tokens, output_tokens)
+        if self.rate_limiter is not None and (input_tokens or output_tokens):
+            self.rate_limiter.record_usage(estimated, input_tokens + output_tokens)
+        text = response_text(response)
+        suggestions = parse(text)
+        if key is not None and any('Error' not in suggestion for suggestion in suggestions):
+            self.cache.put(key, text, input_tokens, output_tokens)
+        return suggestions, input_tokens, output_tokens, False
+
+    def generate_suggestion(self, prompt: str, candidate: int = 0, force: bool = False,
+                            call: Optional[ModelCall] = None) -> Dict:
+        suggestions, input_tokens, output_tokens, cached = self.fetch_response(
+            prompt, lambda text: [self.parse_llm_response(text)], candidate, force, self.request_config(), call)
+        suggestion = suggestions[0]
+        suggestion['Input Tokens'], suggestion['Output Tokens'] = input_tokens, output_tokens
+        if cached:
+            suggestion['Cached'] = True
+        return suggestion
+
+    def generate_suggestions_single_request(self, row: Dict, force: bool = False,
+                                            call: Optional[ModelCall] = None) -> List[Dict]:
+        if self.generation_mode == 'candidate_count':
+            prompt = self.generate_prompt(row)
+            generation_config = self.request_config(candidate_count=self.num_suggestions)
+        else:
+            prompt = self.generate_multi_prompt(row)
+            generation_config = self.request_config(multiple=True)
+        suggestions, input_tokens, output_tokens, cached = self.fetch_response(
+            prompt, lambda text: self.parse_llm_responses(text, self.num_suggestions),
+            force=force, generation_config=generation_config, call=call)
+        # The request is only paid for once, so its usage is reported on the first candidate
+        for i, suggestion in enumerate(suggestions):
+            suggestion['Input Tokens'] = input_tokens if i == 0 else 0
+            suggestion['Output Tokens'] = output_tokens if i == 0 else 0
+            if cached:
+                suggestion['Cached'] = True
+        return suggestions
+
+    def wait_calls(self, calls: Dict[Future, ModelCall]) -> Iterator[Tuple[Future, bool]]:
+        # Yields (future, timed out) as each call finishes or overruns the timeout. Calls still queued
+        # have no deadline yet, so waiting never sleeps past the earliest deadline a running call can have.
+        pending = set(calls)
+        while pending:
+            now = time.monotonic()
+            wait_for = self.timeout
+            for future in list(pending):
+                started_at = calls[future].started_at
+                if started_at is None:
+                    continue
+                left = started_at + self.timeout - now
+                if left <= 0 and not future.done():
+                    pending.discard(future)
+                    calls[future].cancelled.set()
+                    yield future, True
+                else:
+                    wait_for = min(wait_for, left)
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                yield future, False
+
+    def iter_suggestions(self, row: Dict, force: bool = False) -> Iterator[Tuple[int, Dict]]:
+        # Yields (candidate index, suggestion) in completion order. Failed or timed out
+        # candidates are yielded as empty suggestions carrying an 'Error' message.
+        if self.generation_mode != 'separate':
+            yield from self.iter_single_request(row, force)
+            return
+        try:
+            prompt = self.generate_prompt(row)
+        except ValueError as e:
+            # A row that can't fit the input budget is rejected before any request is made
+            for i in range(self.num_suggestions):
+                yield i, empty_suggestion(error=str(e))
+            return
+        executor = ThreadPoolExecutor(max_workers=self.max_workers or self.num_suggestions)
+        calls = [ModelCall() for _ in range(self.num_suggestions)]
+        futures = {executor.submit(self.generate_suggestion, prompt, i, force, calls[i]): i
+                   for i in range(self.num_suggestions)}
+        try:
+            for future, timed_out in self.wait_calls({future: calls[i] for future, i in futures.items()}):
+                i = futures[future]
+                if timed_out:
+                    yield i, empty_suggestion(error=f"Timed out after {self.timeout:g}s")
+                    continue
+                try:
+                    yield i, future.result()
+                except Exception as e:
+                    yield i, empty_suggestion(error=str(e))
+        finally:
+            # Candidates the caller stopped waiting for give up their place in the limiter queue
+            for call in calls:
+                call.cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_single_request(self, row: Dict, force: bool = False) -> Iterator[Tuple[int, Dict]]:
+        executor = ThreadPoolExecutor(max_workers=1)
+        call = ModelCall()
+        future = executor.submit(self.generate_suggestions_single_request, row, force, call)
+        try:
+            for _, timed_out in self.wait_calls({future: call}):
+                if timed_out:
+                    suggestions = [empty_suggestion(error=f"Timed out after {self.timeout:g}s")] * self.num_suggestions
+                else:
+                    suggestions = future.result()
+        except Exception as e:
+            suggestions = [empty_suggestion(error=str(e))] * self.num_suggestions
+        finally:
+            call.cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        for i, suggestion in enumerate(suggestions):
+            yield i, dict(suggestion)
+
+    def process_question(self, row: Dict, force: bool = False) -> List[Dict]:
+        suggestions = [None] * self.num_suggestions
+        with self.metrics.timer('process_question'):
+            for i, suggestion in self.iter_suggestions(row, force=force):
+                suggestions[i] = suggestion
+        self.metrics.incr('failed_suggestions', sum(1 for suggestion in suggestions if 'Error' in suggestion))
+        usage = summarize_usage(suggestions)
+        logger.info("Row tokens: %d input, %d output (%s / %s: %.60s)", usage['input_tokens'], usage['output_tokens'],
+                    row.get('State'), row.get('Attribute'), row.get('Question'))
+        return suggestions
+
+    def parse_llm_responses(self, response: str, count: int) -> List[Dict]:
+        with self.metrics.timer('parse_llm_responses'):
+            return self._parse_llm_responses(response, count)
+
+    def _parse_llm_responses(self, response: str, count: int) -> List[Dict]:
+        blocks = split_candidates(response)
+        if self.response_format == 'json' and len(blocks) == 1:
+            try:
+                data = load_json(response)
+            except ValueError as e:
+                suggestions = [empty_suggestion(error=f"Invalid JSON response: {e}")]
+            else:
+                if isinstance(data, list):
+                    suggestions = [suggestion_from_json(item) if isinstance(item, dict) else empty_suggestion(error="JSON item is not an object")
+                                   for item in data[:count]]
+                elif isinstance(data, dict):
+                    suggestions = [suggestion_from_json(data)]
+                else:
+                    suggestions = [empty_suggestion(error=f"Unexpected JSON type {type(data).__name__} in response")]
+        else:
+            suggestions = [self.parse_llm_response(block) for block in blocks[:count]]
+        while len(suggestions) < count:
+            suggestions.append(empty_suggestion(error=f"Response contained only {len(suggestions)} of {count} suggestions"))
+        return suggestions
+
+    def parse_llm_response(self, response: str) -> Dict:
+        try:
+            with self.metrics.timer('parse_llm_response'):
+                if self.response_format == 'json':
+                    return parse_json_response(response)
+                return parse_text_response(response)
+        except Exception as e:
+            return empty_suggestion(error=f"Error parsing LLM response: {str(e)}")
+
+
+def response_text(response) -> str:
+    candidates = getattr(response, 'candidates', None) or []
+    if len(candidates) <= 1:
+        return response.text
+    # Multiple API candidates are joined with the same delimiters the single_call prompt asks for
+    blocks = []
+    for i, candidate in enumerate(candidates, start=1):
+        text = ''.join(getattr(part, 'text', '') for part in candidate.content.parts)
+        blocks.append(f"=== SUGGESTION {i} ===\n{text}")
+    return '\n'.join(blocks)
+
+
+def response_usage(response) -> Tuple[int, int]:
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return 0, 0
+    return (getattr(usage, 'prompt_token_count', 0) or 0,
+            getattr(usage, 'candidates_token_count', 0) or 0)
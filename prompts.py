@@ -0,0 +1,119 @@
+import logging
+import math
+from typing import Dict, List, Optional
+
+from ratelimit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Models that reject a separate system instruction get it prepended to every request instead
+LEGACY_MODELS = {'gemini-pro', 'gemini-1.0-pro', 'models/gemini-pro', 'models/gemini-1.0-pro'}
+
+INSTRUCTIONS = """You rewrite multiple-choice quiz questions. Each request gives a State, an Attribute, an original question and its four original options. Modify the question and its options to include specific context about the State and the Attribute.
+
+Please provide:
+1. A corrected version of the question with the State and Attribute context. Make sure to include some kind of a cultural or regional artifact in the question.
+2. Modified options that reflect this context but must have the right answer as the State as i dont want confusing options. if you use the State as the right answer for the question form it in a way like which region...? and use other states of india as options and when using other three form it like which culture...? use other cultures as options
+3. The correct answer with explanation
+4. Relevant citations or sources but DO NOT HALLUCINATE or make up information only use word to word citation and try to use wikipedia for citations.
+5. Make sure to include a cultural artifact that is UNIQUE to the State. DO NOT HALLUCINATE about the artifact."""
+
+TEXT_FORMAT_INSTRUCTIONS = """Format your response as follows:
+CORRECTED_QUESTION: [Your modified question]
+CORRECTED_OPTIONS:
+1. [Modified option 1]
+2. [Modified option 2]
+3. [Modified option 3]
+4. [Modified option 4]
+CORRECT_ANSWER: [correct option]
+EXPLANATION: [Detailed explanation]
+CITATIONS: [Relevant sources]"""
+
+JSON_FORMAT_INSTRUCTIONS = """Respond with a JSON object with these fields:
+question: your modified question
+options: a list of exactly 4 modified options
+answer: the text of the correct option
+explanation: a detailed explanation
+citations: relevant sources"""
+
+ROW_TEMPLATE = """State: {State}
+Attribute: {Attribute}
+
+Original Question: {Question}
+
+Original Options:
+1. {Option1}
+2. {Option2}
+3. {Option3}
+4. {Option4}"""
+ROW_FIELDS = ['State', 'Attribute', 'Question', 'Option1', 'Option2', 'Option3', 'Option4']
+# Only the free-text fields are shortened to fit a budget; State and Attribute are kept whole
+TRIMMABLE_FIELDS = ['Question', 'Option1', 'Option2', 'Option3', 'Option4']
+# Below this many tokens per trimmable field the row is rejected instead of sent with its text cut to '…'
+MIN_FIELD_TOKENS = 8
+
+
+def uses_system_instruction(model_name: str) -> bool:
+    return model_name not in LEGACY_MODELS
+
+
+def trim(text: str, tokens: int) -> str:
+    limit = max(0, tokens * 4)
+    return text if len(text) <= limit else text[:max(0, limit - 1)].rstrip() + '…'
+
+
+class PromptBuilder:
+    # The instruction text is rendered once per response format. Requests carry only the row
+    # fields when the model accepts a system instruction, otherwise the cached prefix plus the row.
+    def __init__(self, response_format: str = 'text', system_instruction: bool = True,
+                 max_input_tokens: Optional[int] = None):
+        format_instructions = JSON_FORMAT_INSTRUCTIONS if response_format == 'json' else TEXT_FORMAT_INSTRUCTIONS
+        self.instructions = f"{INSTRUCTIONS}\n\n{format_instructions}"
+        self.system_instruction = system_instruction
+        self.prefix = '' if system_instruction else self.instructions + '\n\n'
+        self.instruction_tokens = estimate_tokens(self.instructions)
+        self.max_input_tokens = max_input_tokens
+        self._template_tokens = estimate_tokens(ROW_TEMPLATE.format(**{field: '' for field in ROW_FIELDS}))
+        # Smallest budget that leaves room for any row's trimmed text, before State and Attribute
+        self.min_input_tokens = self.instruction_tokens + self._template_tokens + MIN_FIELD_TOKENS * len(TRIMMABLE_FIELDS)
+
+    def fields(self, row: Dict, suffix_tokens: int = 0) -> Dict[str, str]:
+        fields = {field: str(row[field]) for field in ROW_FIELDS}
+        if self.max_input_tokens is None:
+            return fields
+        budget = self.max_input_tokens - self.instruction_tokens - self._template_tokens - suffix_tokens
+        budget -= sum(estimate_tokens(fields[field]) for field in ROW_FIELDS if field not in TRIMMABLE_FIELDS)
+        sizes = {field: estimate_tokens(fields[field]) for field in TRIMMABLE_FIELDS}
+        if sum(sizes.values()) <= budget:
+            return fields
+        if budget < MIN_FIELD_TOKENS * len(TRIMMABLE_FIELDS):
+            needed = self.max_input_tokens - budget + MIN_FIELD_TOKENS * len(TRIMMABLE_FIELDS)
+            raise ValueError(f"Input token budget of {self.max_input_tokens} is too small for this row, "
+                             f"it needs at least {needed}")
+        # Shrink the longest fields first: every field keeps at most an equal share of what's left
+        remaining = budget
+        for i, field in enumerate(sorted(TRIMMABLE_FIELDS, key=sizes.get)):
+            share = math.floor(remaining / (len(TRIMMABLE_FIELDS) - i))
+            if sizes[field] > share:
+                fields[field] = trim(fields[field], share)
+            remaining -= min(sizes[field], share)
+        logger.warning("Trimmed row to fit the %d token input budget: %.60s", self.max_input_tokens, row.get('Question'))
+        return fields
+
+    def row_prompt(self, row: Dict, suffix: str = '') -> str:
+        fields = self.fields(row, estimate_tokens(suffix) if suffix else 0)
+        return self.prefix + ROW_TEMPLATE.format(**fields) + suffix
+
+    def request_text(self, prompt: str) -> str:
+        # Everything the model sees for a request, used for cache keys and token estimates
+        return self.instructions + '\n\n' + prompt if self.system_instruction else prompt
+
+    def request_tokens(self, prompt: str) -> int:
+        return estimate_tokens(prompt) + (self.instruction_tokens if self.system_instruction else 0)
+
+
+def summarize_usage(suggestions: List[Dict]) -> Dict[str, int]:
+    return {
+        'input_tokens': sum(suggestion.get('Input Tokens', 0) for suggestion in suggestions),
+        'output_tokens': sum(suggestion.get('Output Tokens', 0) for suggestion in suggestions),
+    }
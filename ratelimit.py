@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+from concurrent.futures import CancelledError
+from typing import Callable, Dict, Optional
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def status_code(exc: Exception) -> Optional[int]:
+    # google.api_core exceptions carry the HTTP status in .code, HTTP clients in .status_code
+    for attr in ('code', 'status_code'):
+        value = getattr(exc, attr, None)
+        if callable(value):
+            continue
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    value = getattr(exc, 'retry_after', None)
+    if value is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+        value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return None
+    # Gemini quota errors report the suggested delay as a RetryInfo detail
+    for detail in getattr(exc, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return getattr(delay, 'seconds', 0) + getattr(delay, 'nanos', 0) / 1e9
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    return status_code(exc) in RETRYABLE_STATUS_CODES or isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[float] = 60, tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        # Buckets hold up to a tenth of a minute's budget so a burst can't spend the whole minute at once
+        self._request_capacity = max(1.0, requests_per_minute / 10) if requests_per_minute else None
+        self._token_capacity = max(1.0, tokens_per_minute / 10) if tokens_per_minute else None
+        self._requests = self._request_capacity or 0.0
+        self._tokens = self._token_capacity or 0.0
+        self._updated = clock()
+        self._paused_until = 0.0
+        # Shrinks after a 429 and recovers on success, so the limiter settles below the server's real quota
+        self._rate_scale = 1.0
+        self._lock = threading.Lock()
+        self.metrics = {
+            'calls': 0,
+            'retries': 0,
+            'throttled': 0,
+            'failures': 0,
+            'queued_seconds': 0.0,
+            'throttled_seconds': 0.0,
+        }
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self._updated)
+        self._updated = now
+        if self._request_capacity is not None:
+            rate = self.requests_per_minute * self._rate_scale / 60
+            self._requests = min(self._request_capacity, self._requests + elapsed * rate)
+        if self._token_capacity is not None:
+            rate = self.tokens_per_minute * self._rate_scale / 60
+            self._tokens = min(self._token_capacity, self._tokens + elapsed * rate)
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        if self._paused_until > now:
+            return self._paused_until - now
+        wait = 0.0
+        if self._request_capacity is not None and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / (self.requests_per_minute * self._rate_scale))
+        if self._token_capacity is not None:
+            # A request larger than the bucket is let through once the bucket is full
+            needed = min(tokens, self._token_capacity)
+            if self._tokens < needed:
+                wait = max(wait, (needed - self._tokens) * 60 / (self.tokens_per_minute * self._rate_scale))
+        return wait
+
+    def acquire(self, tokens: int = 0, cancelled: Optional[threading.Event] = None) -> float:
+        started = self.clock()
+        while True:
+            # A caller that gave up while queued leaves without spending the budget
+            if cancelled is not None and cancelled.is_set():
+                raise CancelledError()
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    if self._request_capacity is not None:
+                        self._requests -= 1
+                    if self._token_capacity is not None:
+                        self._tokens -= tokens
+                    queued = now - started
+                    self.metrics['queued_seconds'] += queued
+                    return queued
+            self.sleep(wait)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        if self._token_capacity is None:
+            return
+        with self._lock:
+            self._tokens -= actual_tokens - estimated_tokens
+
+    def throttle(self, delay: float):
+        # Pause every caller sharing this limiter, not just the one that got the 429
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + delay)
+            self._rate_scale = max(0.1, self._rate_scale / 2)
+
+    def backoff_delay(self, attempt: int, exc: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        suggested = retry_after(exc)
+        if suggested is not None:
+            delay = max(delay, suggested + random.uniform(0, self.base_delay))
+        return delay
+
+    def call(self, fn: Callable, estimated_tokens: int = 0, cancelled: Optional[threading.Event] = None):
+        attempt = 0
+        while True:
+            self.acquire(estimated_tokens, cancelled)
+            with self._lock:
+                self.metrics['calls'] += 1
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self.backoff_delay(attempt, e)
+                # The pause applies even when this caller gives up, so the others still back off
+                if status_code(e) == 429:
+                    with self._lock:
+                        self.metrics['throttled'] += 1
+                    self.throttle(delay)
+                if not is_retryable(e) or attempt >= self.max_retries or (cancelled is not None and cancelled.is_set()):
+                    with self._lock:
+                        self.metrics['failures'] += 1
+                    raise
+                with self._lock:
+                    self.metrics['retries'] += 1
+                    self.metrics['throttled_seconds'] += delay
+                self.sleep(delay)
+                attempt += 1
+                continue
+            with self._lock:
+                self._rate_scale = min(1.0, self._rate_scale + 0.05)
+            return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['rate_scale'] = self._rate_scale
+        return stats
+
+
+_shared_limiters = {}
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(name: str = 'default', **kwargs) -> RateLimiter:
+    # Every caller in the process asking for the same name and settings shares one budget
+    key = (name, tuple(sorted(kwargs.items())))
+    with _shared_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            limiter = _shared_limiters[key] = RateLimiter(**kwargs)
+        return limiter
@@ -0,0 +1,302 @@
+import gc
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Matches in the question count for more than matches in the row's labels or options
+FIELD_WEIGHTS = {
+    'Question': 3,
+    'State': 2,
+    'Attribute': 2,
+    'Option1': 1,
+    'Option2': 1,
+    'Option3': 1,
+    'Option4': 1,
+}
+FILTER_FIELDS = {
+    'state': 'State',
+    'attribute': 'Attribute',
+}
+MAX_PREFIX_EXPANSIONS = 50
+
+TOKEN_PATTERN = re.compile(r'\w+')
+QUERY_PATTERN = re.compile(r'(\w+):(?:"([^"]*)"|(\S+))|"([^"]*)"|(\S+)')
+
+
+def tokenize(value) -> List[str]:
+    if not isinstance(value, str):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return []
+        value = str(value)
+    return TOKEN_PATTERN.findall(value.lower())
+
+
+def parse_query(query: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    # 'state:Kerala attribute:"Folk Dance" sadya' -> (['sadya'], {'State': ['kerala'], 'Attribute': ['folk', 'dance']})
+    terms = []
+    filters = defaultdict(list)
+    for match in QUERY_PATTERN.finditer(query):
+        field, quoted_value, value, phrase, word = match.groups()
+        if field is not None and field.lower() in FILTER_FIELDS:
+            filters[FILTER_FIELDS[field.lower()]].extend(tokenize(quoted_value if quoted_value is not None else value))
+        else:
+            terms.extend(tokenize(match.group(0) if field is not None else (phrase if phrase is not None else word)))
+    return terms, dict(filters)
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._filters: Dict[Tuple[str, str], Set[int]] = {}
+        self._row_terms: Dict[int, Tuple] = {}
+        self._vocabulary: List[str] = []
+        self._new_tokens: List[str] = []
+        # The same postings grouped by weight, each group's row ids kept sorted, so a token's rows can be
+        # walked best first without sorting and an edit only moves the rows it touches
+        self._impacts: Dict[str, Dict[int, List[int]]] = {}
+        # Streamlit reruns repeat the same query, so results are kept until the index changes
+        self._results: Dict[Tuple[str, Optional[int]], List[int]] = {}
+
+    @classmethod
+    def from_frame(cls, df) -> 'SearchIndex':
+        index = cls()
+        fields = [field for field in FIELD_WEIGHTS if field in df.columns]
+        # A bulk load creates several small containers per token and nothing cyclic, so the collector
+        # is paused rather than left to rescan the growing index over and over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for row_id, values in enumerate(zip(*(df[field].tolist() for field in fields))):
+                index.add(row_id, dict(zip(fields, values)))
+        finally:
+            if collecting:
+                gc.enable()
+        index._sync_vocabulary()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._row_terms)
+
+    def _sync_vocabulary(self):
+        # New tokens are sorted in lazily: one-by-one after small edits, in a single sort after a bulk load
+        if not self._new_tokens:
+            return
+        if len(self._new_tokens) > 1000:
+            self._vocabulary = sorted(self._postings)
+        else:
+            for token in self._new_tokens:
+                if token in self._postings:
+                    i = bisect_left(self._vocabulary, token)
+                    if i == len(self._vocabulary) or self._vocabulary[i] != token:
+                        self._vocabulary.insert(i, token)
+        self._new_tokens = []
+
+    def add(self, row_id: int, row: Dict):
+        weights = defaultdict(int)
+        filter_keys = []
+        for field, weight in FIELD_WEIGHTS.items():
+            tokens = tokenize(row.get(field))
+            for token in tokens:
+                weights[token] += weight
+            if field in FILTER_FIELDS.values():
+                filter_keys.extend((field, token) for token in set(tokens))
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._impacts[token] = {}
+                self._new_tokens.append(token)
+            postings[row_id] = weight
+            rows = self._impacts[token].setdefault(weight, [])
+            # Rows arrive in order while the index is built, so this is an append except after edits
+            if not rows or rows[-1] < row_id:
+                rows.append(row_id)
+            else:
+                insort(rows, row_id)
+        self._results.clear()
+        for key in filter_keys:
+            self._filters.setdefault(key, set()).add(row_id)
+        self._row_terms[row_id] = (tuple(weights), tuple(filter_keys))
+
+    def remove(self, row_id: int):
+        terms = self._row_terms.pop(row_id, None)
+        if terms is None:
+            return
+        self._sync_vocabulary()
+        self._results.clear()
+        tokens, filter_keys = terms
+        for token in tokens:
+            postings = self._postings[token]
+            weight = postings.pop(row_id)
+            impacts = self._impacts[token]
+            rows = impacts[weight]
+            del rows[bisect_left(rows, row_id)]
+            if not rows:
+                del impacts[weight]
+            if not postings:
+                del self._postings[token]
+                del self._impacts[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+        for key in filter_keys:
+            rows = self._filters.get(key)
+            if rows is not None:
+                rows.discard(row_id)
+                if not rows:
+                    del self._filters[key]
+
+    def update(self, row_id: int, row: Dict):
+        self.remove(row_id)
+        self.add(row_id, row)
+
+    def _expansions(self, term: str) -> List[Tuple[str, float]]:
+        # Every term is also treated as a prefix so results show up while a word is still being typed.
+        # Exact matches rank above prefix matches.
+        expansions = []
+        start = bisect_left(self._vocabulary, term)
+        for token in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            idf = math.log(1 + len(self._row_terms) / len(self._postings[token]))
+            expansions.append((token, idf * (1.0 if token == term else 0.5)))
+        return expansions
+
+    def _scored_rows(self, token: str, factor: float) -> Iterator[Tuple[float, int]]:
+        # (negated score, row id) in ascending order, which is best match first
+        impacts = self._impacts[token]
+        for weight in sorted(impacts, reverse=True):
+            score = -weight * factor
+            for row_id in impacts[weight]:
+                yield score, row_id
+
+    def _score(self, row_id: int, expansions: List[Tuple[str, float]]) -> float:
+        best = 0.0
+        for token, factor in expansions:
+            weight = self._postings[token].get(row_id)
+            if weight is not None and weight * factor > best:
+                best = weight * factor
+        return best
+
+    def _filter_rows(self, filters: Dict[str, List[str]]) -> Optional[Set[int]]:
+        rows = None
+        for field, tokens in filters.items():
+            for token in tokens:
+                matches = self._filters.get((field, token), set())
+                rows = set(matches) if rows is None else rows & matches
+        return rows
+
+    def _search_single(self, expansions: List[Tuple[str, float]], allowed: Optional[Set[int]],
+                       limit: Optional[int]) -> List[int]:
+        # Walks each expansion's weight-ordered rows in score order and stops once the page is full
+        streams = [self._scored_rows(token, factor) for token, factor in expansions]
+        results = []
+        seen = set()
+        for _, row_id in heapq.merge(*streams):
+            if row_id in seen or (allowed is not None and row_id not in allowed):
+                continue
+            seen.add(row_id)
+            results.append(row_id)
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def _search_top(self, term_expansions: List[List[Tuple[str, float]]], allowed: Optional[Set[int]],
+                    limit: int) -> List[int]:
+        # Threshold algorithm: walks every term's rows best first in step, scores each new row in full
+        # and stops once no row still unseen could make the page. An unseen row scores at most the sum
+        # of the scores at the streams' heads, and on a tie it can't sort before the furthest head.
+        streams = [heapq.merge(*(self._scored_rows(token, factor) for token, factor in expansions))
+                   for expansions in term_expansions]
+        heads = [next(stream, None) for stream in streams]
+        # The best rows so far as (score, -row id), worst on top
+        top = []
+        seen = set()
+        # Rows have to match every term, so once any term runs out nothing unseen can match
+        while all(head is not None for head in heads):
+            if len(top) >= limit:
+                threshold = sum(-head[0] for head in heads)
+                score, negated_row = top[0]
+                if score > threshold or (score == threshold and -negated_row < max(head[1] for head in heads)):
+                    break
+            for i, stream in enumerate(streams):
+                row_id = heads[i][1]
+                heads[i] = next(stream, None)
+                if row_id in seen:
+                    continue
+                seen.add(row_id)
+                if allowed is not None and row_id not in allowed:
+                    continue
+                total = 0.0
+                for expansions in term_expansions:
+                    score = self._score(row_id, expansions)
+                    if not score:
+                        break
+                    total += score
+                else:
+                    if len(top) < limit:
+                        heapq.heappush(top, (total, -row_id))
+                    else:
+                        heapq.heappushpop(top, (total, -row_id))
+        return [-negated_row for _, negated_row in sorted(top, reverse=True)]
+
+    def search(self, query: str, limit: Optional[int] = 100) -> List[int]:
+        # Row ids matching every term and filter, best match first
+        key = (query, limit)
+        if key not in self._results:
+            if len(self._results) >= 256:
+                self._results.clear()
+            self._results[key] = self._search(query, limit)
+        return list(self._results[key])
+
+    def _search(self, query: str, limit: Optional[int]) -> List[int]:
+        self._sync_vocabulary()
+        terms, filters = parse_query(query)
+        allowed = self._filter_rows(filters)
+        if not terms:
+            if allowed is None:
+                return []
+            rows = sorted(allowed)
+            return rows[:limit] if limit is not None else rows
+
+        term_expansions = [self._expansions(term) for term in dict.fromkeys(terms)]
+        if any(not expansions for expansions in term_expansions):
+            return []
+        if len(term_expansions) == 1:
+            return self._search_single(term_expansions[0], allowed, limit)
+
+        # Candidates come from the rarest term (or the filter, if narrower); the others are only probed
+        term_expansions.sort(key=lambda expansions: sum(len(self._postings[token]) for token, _ in expansions))
+        rarest = term_expansions[0]
+        rarest_rows = sum(len(self._postings[token]) for token, _ in rarest)
+        if limit is not None and (allowed is None or len(allowed) >= rarest_rows):
+            return self._search_top(term_expansions, allowed, limit)
+        if allowed is not None and len(allowed) < rarest_rows:
+            candidates = allowed
+        else:
+            candidates = set()
+            for token, _ in rarest:
+                candidates.update(self._postings[token])
+            if allowed is not None:
+                candidates &= allowed
+        scores = {}
+        for row_id in candidates:
+            total = 0.0
+            for expansions in term_expansions:
+                score = self._score(row_id, expansions)
+                if not score:
+                    break
+                total += score
+            else:
+                scores[row_id] = total
+        if limit is None:
+            return sorted(scores, key=lambda row_id: (-scores[row_id], row_id))
+        return [row_id for row_id, _ in heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def build_index(rows: Iterable[Dict]) -> SearchIndex:
+    index = SearchIndex()
+    for row_id, row in enumerate(rows):
+        index.add(row_id, row)
+    return index
@@ -0,0 +1,66 @@
+from itertools import islice
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# Rows rendered in the questions overview when no search is active
+PREVIEW_ROWS = 500
+
+
+class RecordStore:
+    # Columnar store for the loaded sheet. Rows are read and updated in place by position,
+    # and a dirty bitmap records which rows have been edited since loading.
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.dirty = np.zeros(len(self.df), dtype=bool)
+        self._positions = {col: i for i, col in enumerate(self.df.columns)}
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], chunksize: int = 10_000) -> 'RecordStore':
+        # Builds the frame chunk by chunk so the full list of row dicts never exists at once
+        records = iter(records)
+        chunks = []
+        while True:
+            chunk = list(islice(records, chunksize))
+            if not chunk:
+                break
+            chunks.append(pd.DataFrame.from_records(chunk))
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        return cls(df)
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.df.columns)
+
+    @property
+    def changes_made(self) -> bool:
+        return bool(self.dirty.any())
+
+    def changed_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.dirty)
+
+    def row(self, index: int) -> Dict:
+        return {col: self.df.iat[index, position] for col, position in self._positions.items()}
+
+    def _writable_column(self, col: str) -> int:
+        if col not in self._positions:
+            self.df[col] = pd.Series([np.nan] * len(self.df), dtype=object)
+            self._positions[col] = len(self._positions)
+        elif not (pd.api.types.is_object_dtype(self.df[col]) or pd.api.types.is_string_dtype(self.df[col])):
+            # Numeric columns (e.g. an option that was all numbers) can't hold edited text
+            self.df[col] = self.df[col].astype(object)
+        return self._positions[col]
+
+    def update(self, index: int, values: Dict):
+        for col, value in values.items():
+            self.df.iat[index, self._writable_column(col)] = value
+        self.dirty[index] = True
+
+    def window(self, center: int, size: int) -> pd.DataFrame:
+        # A slice around the current row, so the preview doesn't grow with the sheet
+        start = max(0, min(center - size // 2, len(self.df) - size))
+        return self.df.iloc[start:start + size]
@@ -0,0 +1,155 @@
+import argparse
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from jobqueue import DEFAULT_QUEUE_PATH, JOB_SETTINGS, JobQueue
+from processor import QuestionProcessor
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    # Runs queued generations on a pool of threads. Every thread shares one rate limiter, response
+    # cache and cap on in-flight calls, so all sessions feeding the queue draw on the same capacity.
+    def __init__(self, queue: JobQueue, api_key: str, threads: int = 4, cache: Optional[ResponseCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None, max_concurrent_calls: Optional[int] = 8,
+                 poll_interval: float = 0.5, heartbeat_interval: float = 5.0,
+                 retention: float = 24 * 3600, purge_interval: float = 3600.0):
+        self.queue = queue
+        self.api_key = api_key
+        self.threads = threads
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_concurrent_calls = max_concurrent_calls
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stats = {'done': 0, 'failed': 0}
+        self._processors: Dict[Tuple, QuestionProcessor] = {}
+        self._running: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def processor_for(self, settings: Dict) -> QuestionProcessor:
+        # One processor per distinct settings combination, reused across jobs
+        key = tuple(settings.get(name) for name in JOB_SETTINGS)
+        with self._lock:
+            processor = self._processors.get(key)
+            if processor is None:
+                processor = self._processors[key] = QuestionProcessor(
+                    self.api_key, num_suggestions=int(settings.get('num_suggestions') or 3),
+                    timeout=float(settings.get('timeout') or 60.0), max_concurrent_calls=self.max_concurrent_calls,
+                    cache=self.cache, rate_limiter=self.rate_limiter,
+                    generation_mode=settings.get('generation_mode') or 'separate',
+                    response_format=settings.get('response_format') or 'text',
+                    model_name=settings.get('model_name') or 'gemini-pro',
+                    max_input_tokens=settings.get('max_input_tokens'))
+            return processor
+
+    def run_job(self, job: Dict):
+        try:
+            suggestions = self.processor_for(job['settings']).process_question(job['row'], force=job['force'])
+        except Exception as e:
+            logger.exception("Job %s failed", job['id'])
+            self.queue.fail(job['id'], self.worker_id, str(e))
+            status = 'failed'
+        else:
+            self.queue.complete(job['id'], self.worker_id, suggestions)
+            status = 'done'
+        with self._lock:
+            self.stats[status] += 1
+
+    def _loop(self, thread_id: str):
+        while not self._stop.is_set():
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            with self._lock:
+                self._running[thread_id] = job['id']
+            try:
+                self.run_job(job)
+            finally:
+                with self._lock:
+                    self._running.pop(thread_id, None)
+
+    def _heartbeat(self):
+        purged_at = None
+        while not self._stop.is_set():
+            with self._lock:
+                running = list(self._running.values())
+            self.queue.heartbeat(self.worker_id)
+            for job_id in running:
+                self.queue.heartbeat(self.worker_id, job_id)
+            # Finished jobs are dropped once they are older than the retention period
+            if purged_at is None or time.monotonic() - purged_at >= self.purge_interval:
+                purged = self.queue.purge(self.retention)
+                if purged:
+                    logger.info("Purged %d finished jobs", purged)
+                purged_at = time.monotonic()
+            self._stop.wait(self.heartbeat_interval)
+
+    def run(self):
+        logger.info("Worker %s polling %s with %d threads", self.worker_id, self.queue.path, self.threads)
+        threads = [threading.Thread(target=self._heartbeat, daemon=True)]
+        threads += [threading.Thread(target=self._loop, args=(str(i),), daemon=True) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self._stop.is_set():
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            logger.info("Stopping after the jobs in progress finish")
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            self.queue.remove_worker(self.worker_id)
+            logger.info("Worker %s stopped: %s", self.worker_id, self.stats)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued suggestion jobs for the Question Context Updater app.")
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help="job queue database shared with the app")
+    parser.add_argument('--api-key', default=os.environ.get('GOOGLE_API_KEY'),
+                        help="Gemini API key (defaults to $GOOGLE_API_KEY)")
+    parser.add_argument('--threads', type=int, default=4, help="jobs processed at the same time")
+    parser.add_argument('--max-concurrent-calls', type=int, default=8, help="model calls in flight at the same time")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="response cache database")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the response cache")
+    parser.add_argument('--rpm', type=float, default=60, help="request budget per minute")
+    parser.add_argument('--tpm', type=float, default=None, help="token budget per minute")
+    parser.add_argument('--max-retries', type=int, default=5, help="retries for 429 and 5xx errors")
+    parser.add_argument('--keep-hours', type=float, default=24, help="hours finished jobs are kept before they are purged")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or $GOOGLE_API_KEY)")
+
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    rate_limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm, max_retries=args.max_retries)
+    queue = JobQueue(args.queue)
+    worker = Worker(queue, args.api_key, threads=args.threads, cache=cache, rate_limiter=rate_limiter,
+                    max_concurrent_calls=args.max_concurrent_calls, retention=args.keep_hours * 3600)
+    try:
+        worker.run()
+    finally:
+        queue.close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == '__main__':
+    main()